@@ -1,52 +1,88 @@
 import os
-import csv
-from datetime import datetime
-from collections import defaultdict
+from datetime import datetime, date, timedelta
 import requests
+import numpy as np
+import pandas as pd
 import config
+import csv_export
+import http_cache
+import quality
+import rollups
+import trends
+import instrumentation
+from daily_series import DailySeries
 
+# Recent days may still be revised by the archive API, so their responses are cached for a short time only
+RECENT_DAYS = 7
+RECENT_TTL_SEC = 6 * 3600
 
-def fetch_openmeteo_weather_data(latitude, longitude, start_date, end_date, enforce_api_call=False):
+
+def fetch_openmeteo_hourly(latitude, longitude, start_date, end_date):
+    """
+    Fetch hourly temperatures from Open-Meteo API through the response cache.
+    The date range is requested one calendar year at a time, so overlapping date ranges
+    reuse the cached years and only the missing years go to the network.
+    Returns the API `hourly` dict with `time` and `temperature_2m` lists.
+    """
+    hourly = {"time": [], "temperature_2m": []}
+    recent = (date.today() - timedelta(days=RECENT_DAYS)).isoformat()
+    for year in range(int(start_date[:4]), int(end_date[:4]) + 1):
+        chunk_start = max(start_date, f"{year}-01-01")
+        chunk_end = min(end_date, f"{year}-12-31")
+        url = config.OPEN_METEO_API_TMPL.format(
+            lat=latitude, long=longitude, start_dt=chunk_start, end_dt=chunk_end
+        )
+        json_data = http_cache.get_json(url, ttl=RECENT_TTL_SEC if chunk_end >= recent else None)
+        if "hourly" not in json_data or "temperature_2m" not in json_data["hourly"]:
+            return None
+        hourly["time"] += json_data["hourly"]["time"]
+        hourly["temperature_2m"] += json_data["hourly"]["temperature_2m"]
+    return hourly
+
+
+def save_checked_cache(hourly, cache_file):
+    """
+    Run the data quality stage on hourly data and save the result as the cache file
+    (`time`, `temperature`, `quality` flags), with the report next to it.
+    """
+    clean, report = quality.check_hourly(hourly)
+    csv_export.write_csv(cache_file, {column: clean[column].to_numpy() for column in clean.columns}, decimals=2)
+    quality.write_report(report, cache_file.replace(".csv", "-quality.json"))
+    print(quality.summary(report))
+    print(f"Data cached to file: {cache_file}")
+    return clean
+
+
+def fetch_openmeteo_weather_data(latitude, longitude, start_date, end_date, enforce_api_call=False, cache_file=None):
     """
     Fetch weather data from Open-Meteo API,
-    Caching the results in a file in the `data` folder.
-    The cached file contains `time` and `temperature`. 
-    Depending on global var `calc_logic`, return daily max, min, or avg temperature.
+    Caching the results in a file in the `data` folder (`cache_file`, openmeteo-<start>-<end>.csv by default).
+    The cached file contains `time`, `temperature` and the `quality` flags of every hour (see quality.py).
+    Depending on global var `calc_logic`, return daily max, min, or avg temperature as a DailySeries.
     """
     
     # Define the cache file path
-    cache_file = f"{data_dir}/openmeteo-{start_date.replace('-', '')}-{end_date.replace('-', '')}.csv"
+    if cache_file is None:
+        cache_file = f"{data_dir}/openmeteo-{start_date.replace('-', '')}-{end_date.replace('-', '')}.csv"
 
     # Fetch fresh data from API if enforce_api_call is True or cache doesn't exist
+    # (API responses themselves are cached by http_cache, so this only calls the network for new requests)
     if enforce_api_call or not os.path.exists(cache_file) or os.path.getsize(cache_file) == 0:
         print("Fetching fresh data from API...")
         try:
-            base_url = config.OPEN_METEO_API_TMPL.format(
-                lat=latitude, long=longitude, start_dt=start_date, end_dt=end_date
-            )
-            response = requests.get(base_url)
-            response.raise_for_status()
-            json_data = response.json()
+            hourly_data = fetch_openmeteo_hourly(latitude, longitude, start_date, end_date)
 
             # Validate response data
-            if "hourly" not in json_data or "temperature_2m" not in json_data["hourly"]:
+            if hourly_data is None:
                 print("Error: API response does not contain valid temperature data.")
                 return None
 
-            # Extract hourly data
-            hourly_data = json_data["hourly"]
-            hourly_records = [
-                {"time": time, "temperature": temp}
-                for time, temp in zip(hourly_data["time"], hourly_data["temperature_2m"])
-                if temp is not None  # Exclude rows without temperature
-            ]
-
-            # Save data to cache file
-            with open(cache_file, mode='w', newline='') as file:
-                writer = csv.DictWriter(file, fieldnames=["time", "temperature"])
-                writer.writeheader()
-                writer.writerows(hourly_records)
-            print(f"Data cached to file: {cache_file}")
+            # Check, fill and flag the hours once, the cache file keeps the result with its quality flags
+            hourly = pd.DataFrame({"time": hourly_data["time"], "temperature": hourly_data["temperature_2m"]})
+            clean = save_checked_cache(hourly, cache_file)
+
+            # Update only the day/week/month/season/year/decade buckets touched by the new hours
+            rollups.update_rollups(clean.assign(temperature=quality.usable(clean)))
 
         except requests.exceptions.RequestException as e:
             print(f"Error fetching data from Open-Meteo API: {e}")
@@ -54,163 +90,114 @@ def fetch_openmeteo_weather_data(latitude, longitude, start_date, end_date, enfo
 
     # Read data from cache file
     print(f"Reading data from cache: {cache_file}")
-    daily_data = defaultdict(list)
-    with open(cache_file, mode='r') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            time = row["time"]
-            temp_str = row["temperature"]
-            # Validate temperature value
-            if temp_str.strip():  # Skip empty or whitespace-only strings
-                try:
-                    temperature = float(temp_str)
-                    date = time.split("T")[0]  # Extract the date part
-                    daily_data[date].append(temperature)
-                except ValueError:
-                    print(f"Skipping invalid temperature value: {temp_str} at time {time}")
-
-    # Calculate daily temperature based on calc_logic
-    formatted_data = []
-    for date, temperatures in daily_data.items():
-        if temperatures:  # Ensure there's at least one valid temperature
-            if calc_logic == 'avg':
-                result_temp = round(sum(temperatures) / len(temperatures),2)
-            elif calc_logic == 'min':
-                result_temp = min(temperatures)
-            else:  # Default to 'max'
-                result_temp = max(temperatures)
-            formatted_data.append({"date": date, "temperature": result_temp})
+    clean = quality.load_hourly(cache_file)
+
+    # Calculate daily temperature based on calc_logic, one float32 per calendar day
+    how = calc_logic if calc_logic in ("avg", "min") else "max"  # Default to 'max'
+    formatted_data = DailySeries.from_hourly(clean["time"].to_numpy(), clean["temperature"].to_numpy(), how,
+                                             decimals=2 if how == "avg" else None)
 
     return formatted_data
 
 def calculate_daily_averages(data):
     """
     Calculate the daily averages from the weather data.
-    This assumes 'data' is a list of dictionaries with 'date' and 'temperature'.
+    'data' is a DailySeries, which already holds a single value per day, so this only rounds it.
     """
-    daily_averages_ret = {}
-    for entry in data:
-        date = entry['date']
-        temperature = entry['temperature']
-
-        if date not in daily_averages_ret:
-            daily_averages_ret[date] = []
-        daily_averages_ret[date].append(temperature)
-
-    # Now calculate the average temperature for each day
-    for date, temps in daily_averages_ret.items():
-        daily_averages_ret[date] = round(sum(temps) / len(temps), 2)
-
-    return daily_averages_ret
+    return data.round(2)
 
 def calculate_yearly_averages(daily_data):
     """
-    Calculate average temperature for each year and yearly temperature coefficients (change from the previous year).
+    Calculate average temperature for each year, change from the previous year (in degrees),
+    anomaly against the baseline climatology and completeness of the year.
+    Partial years (e.g. a range ending Dec 5) are flagged with COMPLETE=False and have no CHANGE.
     """
-    yearly_data = {}
-    
-    # Step 1: Aggregate temperature data for each year
-    for date_str, temp in daily_data.items():
-        year = date_str[:4]
-        
-        # Ensure temp is a number (float or int)
-        try:
-            temp = float(temp)  # Convert temp to float if it's not already
-        except (ValueError, TypeError):
-            print(f"Warning: Skipping invalid temperature data for {date_str}: {temp}")
-            continue  # Skip invalid data
-
-        if year not in yearly_data:
-            yearly_data[year] = []
-        yearly_data[year].append(temp)
+    daily = daily_data.to_series().to_frame()
+    yearly, _ = trends.analyze(daily)
 
-    # Step 2: Calculate yearly averages
     yearly_averages = {}
-    for year, temps in yearly_data.items():
-        if temps:  # Ensure that there are temperatures to calculate
-            yearly_averages[year] = {
-                'TEMPERATURE': round(sum(temps) / len(temps),2),  # Calculate average temperature for the year
-                'CHANGE': 1  # Placeholder for temperature change (to be calculated next)
-            }
-        else:
-            print(f"Warning: No valid data for year {year}")
-            yearly_averages[year] = {
-                'TEMPERATURE': None,
-                'CHANGE': None
-            }
-
-    # Step 3: Calculate yearly temperature coefficients (change from previous year)
-    for year in sorted(yearly_averages.keys())[1:]:  # Start from the second year
-        prev_year = str(int(year) - 1)
-        if prev_year in yearly_averages and yearly_averages[prev_year]['TEMPERATURE'] is not None:
-            prev_temp = yearly_averages[prev_year]['TEMPERATURE']
-            current_temp = yearly_averages[year]['TEMPERATURE']
-            if prev_temp != 0:  # Avoid division by zero
-                change = round(current_temp / prev_temp,2)
-            else:
-                change = 1
-            yearly_averages[year]['CHANGE'] = change
-
+    for (year, _), row in yearly.iterrows():
+        yearly_averages[str(year)] = {
+            column: (None if pd.isna(row[column]) else row[column])
+            for column in ["TEMPERATURE", "CHANGE", "ANOMALY", "DAYS", "COMPLETE"]
+        }
     return yearly_averages
 
-def write_daily_data_to_csv(daily_data):
+def calculate_trend(yearly_averages):
+    """
+    Least-squares trend of the complete years, in degrees per decade with its 95% confidence interval.
+    """
+    yearly = pd.DataFrame.from_dict(yearly_averages, orient="index")
+    yearly.index = yearly.index.astype(int)
+    mean = yearly[["TEMPERATURE"]].astype(float)
+    complete = yearly[["COMPLETE"]].fillna(False).astype(bool).rename(columns={"COMPLETE": "TEMPERATURE"})
+    return trends.linear_trend(mean, complete).loc["TEMPERATURE"]
+
+def write_daily_data_to_csv(daily_data, compression=config.EXPORT_COMPRESSION):
     """
-    Write daily data to CSV.
+    Write daily data to CSV (days without data are skipped).
+    The whole file is formatted at once and replaces the previous one atomically.
     """
-    output_file = f"{data_dir}/daily-{calc_logic}.csv"
-    with open(output_file, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["Date", "TEMPERATURE"])
-        
-        # Write each date's average temperature
-        for date_str, temperature in daily_data.items():
-            writer.writerow([date_str, temperature])
+    valid = ~np.isnan(daily_data.values)
+    output_file = csv_export.write_csv(f"{data_dir}/daily-{calc_logic}.csv", {
+        "Date": daily_data.dates[valid],
+        "TEMPERATURE": daily_data.values[valid],
+    }, decimals=2, compression=compression)
 
     print(f"Daily data saved to {output_file}")
 
-def write_yearly_averages_to_csv(yearly_averages):
+def write_yearly_averages_to_csv(yearly_averages, compression=config.EXPORT_COMPRESSION):
     """
-    Write yearly averages data to CSV.
+    Write yearly averages data to CSV (TEMPERATURE, CHANGE, ANOMALY and completeness of each year).
+    The whole file is formatted at once and replaces the previous one atomically.
     """
-    output_file = f"{data_dir}/yearly-{calc_logic}.csv"
+    columns = {"Year": list(yearly_averages)}
+    for column in ["TEMPERATURE", "CHANGE", "ANOMALY", "DAYS", "COMPLETE"]:
+        columns[column] = [data[column] for data in yearly_averages.values()]
+    output_file = csv_export.write_csv(f"{data_dir}/yearly-{calc_logic}.csv", columns, compression=compression)
 
-    with open(output_file, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["Year", "TEMPERATURE", "CHANGE"])
-        
-        # Write each year's data (TEMPERATURE and CHANGE)
-        for year, data in yearly_averages.items():
-            writer.writerow([year, data['TEMPERATURE'], data['CHANGE']])
-    
     print(f"Yearly averages saved to {output_file}")
 
-def main(pLogic, pStart, pEnd):
+def main(pLogic, pStart, pEnd, pDataDir=None, pCacheFile=None):
     global data_dir, calc_logic
     calc_logic, start_date, end_date = pLogic, pStart, pEnd
 
     # Define constants
     latitude,longitude  = 40.7282,-74.0776   # latitude and longitude  of Jersey City 
     
-    data_dir=f"data/{start_date.replace('-', '')}-{end_date.replace('-', '')}"
+    # Folder of the date range, unless given (e.g. a fixed folder for a range ending today)
+    data_dir = pDataDir or f"data/{start_date.replace('-', '')}-{end_date.replace('-', '')}"
     # Ensure the `data` directory exists
     os.makedirs(data_dir, exist_ok=True)
     
     print("Fetching weather data...")
-    data = fetch_openmeteo_weather_data( latitude, longitude, start_date, end_date)
-    if not data or not isinstance(data, list) or len(data) == 0:
+    with instrumentation.stage("fetch") as stage:
+        data = fetch_openmeteo_weather_data( latitude, longitude, start_date, end_date, cache_file=pCacheFile)
+        stage.rows_out = data.count() if data else 0
+    if not data or not isinstance(data, DailySeries) or data.count() == 0:
         print("Error: No valid temperature data found!")
         return
 
     print("Calculating daily averages ...")
-    daily_avg  = calculate_daily_averages(data)
-
-    print("Calculating yearly averages and coefficients...")
-    yearly_averages  = calculate_yearly_averages(daily_avg)
+    with instrumentation.stage("aggregate_daily", rows_in=data.count()) as stage:
+        daily_avg  = calculate_daily_averages(data)
+        stage.rows_out = daily_avg.count()
+
+    print("Calculating yearly averages, changes and anomalies...")
+    with instrumentation.stage("aggregate_yearly", rows_in=daily_avg.count()) as stage:
+        yearly_averages  = calculate_yearly_averages(daily_avg)
+        trend = calculate_trend(yearly_averages)
+        stage.rows_out = len(yearly_averages)
+    print(f"Trend: {trend['slope_per_decade']:.2f}°C per decade "
+          f"(95% CI {trend['ci_low']:.2f} to {trend['ci_high']:.2f}, {int(trend['n'])} complete years)")
 
     print("Saving data into CSV...")
-    write_daily_data_to_csv(daily_avg)
-    write_yearly_averages_to_csv(yearly_averages)
+    with instrumentation.stage("write_csv", rows_in=daily_avg.count() + len(yearly_averages)) as stage:
+        write_daily_data_to_csv(daily_avg)
+        write_yearly_averages_to_csv(yearly_averages)
+        stage.rows_out = stage.rows_in
 
+    print(f"HTTP cache: {http_cache.cache.stats}")
     print("Processing complete! Results saved to CSV.")
 
 # pLogic, pStart, pEnd = "max", "1964-01-01", "2023-12-31"
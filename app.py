@@ -1,23 +1,64 @@
-from flask import Flask, render_template
-import pandas as pd
+from flask import Blueprint, Flask, jsonify, render_template
+from html import escape
+import csv
 import os
+import instrumentation
 
-app = Flask(__name__)
+# Forecast routes, mounted by this app and by the combined production server (server.py)
+bp = Blueprint('forecast', __name__, template_folder='templates')
+
+FORECAST_FILE = 'data/forecast_output.csv'
+
+def read_forecast(forecast_file):
+    """
+    Read the forecast CSV as a header and a list of rows.
+    Uses the csv module, so serving the page does not import pandas.
+    """
+    with open(forecast_file, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, [])
+        return header, [row for row in reader if row]
+
+def to_number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+def forecast_table_html(header, rows):
+    """
+    HTML table of the forecast, same markup as pandas `to_html(classes='table table-striped', index=False)`.
+    """
+    head = "".join(f"<th>{escape(column)}</th>" for column in header)
+    body = "".join(
+        "<tr>" + "".join(f"<td>{escape(value)}</td>" for value in row) + "</tr>"
+        for row in rows
+    )
+    return (f'<table border="1" class="dataframe table table-striped">'
+            f'<thead><tr style="text-align: right;">{head}</tr></thead><tbody>{body}</tbody></table>')
 
-@app.route('/')
+@bp.route('/')
 def home():
     # Ensure the forecast file exists
-    forecast_file = 'data/forecast_output.csv' 
-    if not os.path.exists(forecast_file):
+    if not os.path.exists(FORECAST_FILE):
         return "Forecast data not found. Please run the forecast script first."
 
-    # Read the forecast data
-    forecast_df = pd.read_csv(forecast_file)
-
-    # Convert the DataFrame to HTML
-    forecast_html = forecast_df.to_html(classes='table table-striped', index=False)
+    # Read the forecast data and convert it to HTML
+    header, rows = read_forecast(FORECAST_FILE)
+    forecast_html = forecast_table_html(header, rows)
 
     return render_template('index.html', table=forecast_html)
 
+@bp.route('/forecast.json')
+def forecast_json():
+    if not os.path.exists(FORECAST_FILE):
+        return jsonify({"error": "Forecast data not found"}), 404
+    header, rows = read_forecast(FORECAST_FILE)
+    return jsonify([{column: to_number(value) for column, value in zip(header, row)} for row in rows])
+
+app = Flask(__name__)
+app.register_blueprint(bp)
+instrumentation.instrument_app(app)  # Adds /metrics
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8080)
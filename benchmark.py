@@ -0,0 +1,375 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from scripts import load_script
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Datasets shipped in data/ used by the offline benchmarks
+HOURLY_FILE = "data/20100101-20241205/openmeteo-20100101-20241205.csv"
+DAILY_FILE = "data/20100101-20241205/daily-max.csv"
+LEGACY_FILE = "data/old/output-20000101-20241123.csv"
+YEARLY_DIR = "data/19640101-20231231"
+
+
+def synthetic_hourly(years=30, stations=1, start_year=1990, seed=42):
+    """
+    Generate hourly temperatures with a seasonal cycle, a daily cycle, a warming trend and noise.
+    Returns a DataFrame indexed by time with one column per station.
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(f"{start_year}-01-01", f"{start_year + years - 1}-12-31 23:00", freq="h")
+    t = np.arange(len(index)) / 24.0
+    base = 12 + 11 * np.sin(2 * np.pi * (t - 110) / 365.25) + 4 * np.sin(2 * np.pi * (t % 1 - 0.375)) + 0.0007 * t / 10
+    offsets = rng.normal(0, 2, stations)
+    values = base[:, None] + offsets[None, :] + rng.normal(0, 2.5, (len(index), stations))
+    return pd.DataFrame(values.astype("float32"), index=index, columns=[f"S{i:03d}" for i in range(stations)])
+
+
+def synthetic_daily(years=30, stations=1, start_year=1990, seed=42):
+    """
+    Daily mean temperatures derived from `synthetic_hourly`.
+    """
+    return synthetic_hourly(years, stations, start_year, seed).resample("D").mean()
+
+
+def measure(func, repeat=3, warmup=1):
+    """
+    Run `func` `warmup + repeat` times and return timing statistics (seconds) of the measured runs.
+    """
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        "repeat": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "max": max(times),
+    }
+
+
+def traced_bytes(build):
+    """
+    Memory (bytes) held by the object `build` returns, measured with tracemalloc.
+    """
+    tracemalloc.start()
+    try:
+        result = build()  # Kept referenced until measured
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def load_test(client, paths, requests_count=200, concurrency=8):
+    """
+    Send `requests_count` GET requests spread over `paths` with `concurrency` threads.
+    Returns latency percentiles (seconds) and throughput (requests per second).
+    """
+    def call(i):
+        start = time.perf_counter()
+        response = client.get(paths[i % len(paths)])
+        response.close()
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests_count)))
+    elapsed = time.perf_counter() - start
+    latencies = np.array([latency for latency, _ in results])
+    return {
+        "repeat": requests_count,
+        "concurrency": concurrency,
+        "errors": sum(1 for _, status in results if status >= 400),
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "p99": float(np.percentile(latencies, 99)),
+        "throughput": requests_count / elapsed,
+        # Used to compare runs
+        "median": float(np.percentile(latencies, 50)),
+    }
+
+
+def bench_ingest(repeat):
+    """
+    Read, aggregate and export the shipped hourly file from a copy in a scratch folder,
+    so the files in the repository are never rewritten.
+    """
+    import shutil
+
+    main = load_script("Climate Change Main.py", "climate_main")
+    start_date, end_date = "2010-01-01", "2024-12-05"
+    with tempfile.TemporaryDirectory() as data_dir:
+        shutil.copy(os.path.join(ROOT, HOURLY_FILE), data_dir)
+        with open(os.path.join(data_dir, os.path.basename(HOURLY_FILE))) as file:
+            rows = sum(1 for _ in file) - 1  # Without the header
+        main.data_dir, main.calc_logic = data_dir, "max"
+        data = main.fetch_openmeteo_weather_data(40.7282, -74.0776, start_date, end_date)
+        daily = main.calculate_daily_averages(data)
+
+        yield "ingest.cache_read", {"rows": rows}, measure(
+            lambda: main.fetch_openmeteo_weather_data(40.7282, -74.0776, start_date, end_date), repeat)
+        yield "aggregate.daily", {"days": len(data)}, measure(lambda: main.calculate_daily_averages(data), repeat)
+        yield "aggregate.yearly", {"days": len(daily)}, measure(lambda: main.calculate_yearly_averages(daily), repeat)
+
+        yearly = main.calculate_yearly_averages(daily)
+        for compression in (None, "gzip"):
+            yield f"export.csv.{compression or 'plain'}", {"days": len(daily), "years": len(yearly)}, measure(
+                lambda: (main.write_daily_data_to_csv(daily, compression),
+                         main.write_yearly_averages_to_csv(yearly, compression)), repeat)
+
+
+def bench_aggregation(repeat, years, stations):
+    import rollups
+    import trends
+
+    hourly = synthetic_hourly(years, 1)
+    frame = pd.DataFrame({"time": hourly.index.strftime("%Y-%m-%dT%H:%M"), "temperature": hourly.iloc[:, 0]})
+    with tempfile.TemporaryDirectory() as rollup_dir:
+        yield "aggregate.rollups_build", {"years": years}, measure(
+            lambda: rollups.update_rollups(frame, tempfile.mkdtemp(dir=rollup_dir)), repeat)
+        rollups.update_rollups(frame, rollup_dir)
+        last_day = frame.iloc[-24:]
+        yield "aggregate.rollups_update_day", {"years": years}, measure(
+            lambda: rollups.update_rollups(last_day, rollup_dir), repeat)
+        yield "aggregate.rollups_query_month", {"years": years}, measure(
+            lambda: rollups.query("month", rollup_dir=rollup_dir), repeat)
+
+    daily = synthetic_daily(years, stations)
+    yield "aggregate.trends", {"years": years, "stations": stations}, measure(lambda: trends.analyze(daily), repeat)
+
+    # 16 x 16 grid points (4 chunks), 5 years of synthetic hourly data
+    import grid
+    with tempfile.TemporaryDirectory() as store_dir:
+        hourly = synthetic_hourly(5, 16 * 16, start_year=2015)
+        axis = np.arange(16) * 0.25
+        store = grid.GridStore.create(store_dir, axis, axis, "2015-01-01", "2019-12-31")
+        for year, _, _ in grid.year_ranges(store.start_date, store.end_date):
+            values = hourly.loc[str(year)].to_numpy().reshape(-1, 16, 16)
+            for i, j, lat_slice, lon_slice in store.chunks():
+                store.write("hourly", year, i, j, values[:, lat_slice, lon_slice])
+        yield "aggregate.grid", {"years": 5, "points": 16 * 16}, measure(lambda: grid.aggregate_grid(store), repeat)
+
+
+def bench_memory(repeat, years, stations):
+    """
+    Daily data of `stations` stations as lists of {"date", "temperature"} dicts (before)
+    and as DailySeries (after): memory held and time to build.
+    """
+    from daily_series import DailySeries
+
+    daily = synthetic_daily(years, stations).round(2)
+    days = daily.index.to_numpy().astype("datetime64[D]")
+    columns = [daily[column].to_numpy() for column in daily.columns]
+
+    def records():
+        # Date strings are created per station, like when each station is read from its own file
+        return [[{"date": date, "temperature": temperature}
+                 for date, temperature in zip(np.datetime_as_string(days).tolist(), values.tolist())]
+                for values in columns]
+
+    def series():
+        return [DailySeries.from_dates(days, values) for values in columns]
+
+    for name, build in (("memory.daily_records", records), ("memory.daily_series", series)):
+        size = traced_bytes(build)
+        params = {"years": years, "stations": stations, "bytes": size, "bytes_per_day": round(size / daily.size, 1)}
+        yield name, params, measure(build, repeat)
+
+
+def bench_features(repeat):
+    import rolling
+
+    rf = load_script("forecast-random-forest.py", "forecast_random_forest")
+    data = rf.load_and_parse_csv(os.path.join(ROOT, DAILY_FILE))
+    series = rf.daily_history(data)
+    yield "features.random_forest", {"rows": len(series)}, measure(
+        lambda: rf.lagged_features(series.to_numpy(), series.index), repeat)
+
+    values = synthetic_daily(60, 1).iloc[:, 0].to_numpy()
+    yield "features.rolling_stats", {"rows": len(values)}, measure(
+        lambda: rolling.rolling_stats(values, (3, 5, 10, 365), rolling.STATS), repeat)
+
+
+def bench_forecast(repeat, sarima):
+    linear = load_script("forecast.py", "forecast_linear")
+    yield "forecast.linear.fit_predict", {"file": LEGACY_FILE}, measure(
+        lambda: linear.forecast_next_days(os.path.join(ROOT, LEGACY_FILE), days=10), repeat)
+
+    rf = load_script("forecast-random-forest.py", "forecast_random_forest")
+    series = rf.daily_history(rf.load_and_parse_csv(os.path.join(ROOT, DAILY_FILE)))
+    X, complete = rf.lagged_features(series.to_numpy(), series.index)
+    X, y = X[complete], series.to_numpy()[complete]
+    model = rf.train_model(X, y)
+    yield "forecast.random_forest.fit", {"rows": len(X)}, measure(lambda: rf.train_model(X, y), repeat, warmup=0)
+    yield "forecast.random_forest.predict", {"days": 10}, measure(
+        lambda: rf.forecast_next_days(model, series, days=10), repeat)
+
+    if sarima:
+        # Seasonal period of 365 days makes auto_arima take very long, so it is opt-in
+        sar = load_script("forecast-sarima.py", "forecast_sarima")
+        daily = sar.load_and_parse_csv(os.path.join(ROOT, DAILY_FILE))
+        with tempfile.TemporaryDirectory() as model_dir:
+            model_file = os.path.join(model_dir, "model.pkl")
+            yield "forecast.sarima.fit", {"rows": len(daily)}, measure(
+                lambda: sar.train_model(daily["T"], tempfile.mktemp(suffix=".pkl", dir=model_dir)), 1, warmup=0)
+            model = sar.train_model(daily["T"], model_file)
+            yield "forecast.sarima.predict", {"days": 10}, measure(
+                lambda: sar.sarima_forecast(model, daily.index.max(), 10), repeat)
+
+
+def bench_web(requests_count, concurrency):
+    """
+    Load test the Flask routes in a scratch working directory, so generated plots
+    and forecast files never overwrite the ones in the repository.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.makedirs(os.path.join(work_dir, "data"))
+        os.symlink(os.path.join(ROOT, YEARLY_DIR), os.path.join(work_dir, YEARLY_DIR))
+        pd.DataFrame({
+            "Date": pd.date_range("2024-12-05", periods=10).strftime("%Y-%m-%d"),
+            "Predicted Temperature (°C)": np.linspace(3, 6, 10).round(2),
+        }).to_csv(os.path.join(work_dir, "data/forecast_output.csv"), index=False)
+        os.chdir(work_dir)
+        try:
+            forecast_app = load_script("app.py", "forecast_app").app
+            plot_app = load_script("flask-webserver.py", "plot_app").app
+            plot_app.test_client().get("/")  # Generate the plots once
+
+            yield "web.forecast_index", {}, load_test(forecast_app.test_client(), ["/"], requests_count, concurrency)
+            yield "web.plot_image", {}, load_test(
+                plot_app.test_client(), ["/static/yearly-avg-plot.png"], requests_count, concurrency)
+            yield "web.plot_index", {}, load_test(
+                plot_app.test_client(), ["/"], max(requests_count // 20, concurrency), concurrency)
+        finally:
+            os.chdir(cwd)
+
+
+# Entry points and a lightweight request that must not need the scientific stack
+STARTUP_ENTRY_POINTS = {
+    "app": ("app.py", "/forecast.json"),
+    "plot_webserver": ("flask-webserver.py", "/static/yearly-avg-plot.png"),
+    "climate_main": ("Climate Change Main.py", None),
+    "forecast_linear": ("forecast.py", None),
+    "forecast_sarima": ("forecast-sarima.py", None),
+    "forecast_random_forest": ("forecast-random-forest.py", None),
+    "pipeline": ("pipeline.py", None),
+}
+HEAVY_MODULES = ("pandas", "matplotlib", "sklearn", "scipy", "pmdarima", "statsmodels")
+
+STARTUP_CODE = """
+import json, sys
+from scripts import load_script
+module = load_script({file_name!r}, {module_name!r})
+if {path!r}:
+    module.app.test_client().get({path!r}).close()
+print(json.dumps([name for name in {heavy!r} if name in sys.modules]))
+"""
+
+
+def bench_startup(repeat):
+    """
+    Time a fresh interpreter importing each entry point (and serving one lightweight request
+    for the web apps), and report which heavy libraries ended up imported.
+    """
+    for module_name, (file_name, path) in STARTUP_ENTRY_POINTS.items():
+        code = STARTUP_CODE.format(file_name=file_name, module_name=module_name, path=path, heavy=HEAVY_MODULES)
+        loaded = []
+
+        def start():
+            result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+            loaded[:] = json.loads(result.stdout.strip().splitlines()[-1])
+
+        timing = measure(start, repeat)
+        yield f"startup.{module_name}", {"file": file_name, "request": path, "heavy_modules": list(loaded)}, timing
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline_file, threshold):
+    """
+    Compare median times with a previous result file; return the names of benchmarks
+    slower than `threshold` times the baseline.
+    """
+    with open(baseline_file) as file:
+        baseline = {entry["name"]: entry for entry in json.load(file)["results"]}
+    regressions = []
+    for entry in results:
+        previous = baseline.get(entry["name"])
+        if previous is None:
+            continue
+        ratio = entry["median"] / previous["median"] if previous["median"] else float("inf")
+        flag = "REGRESSION" if ratio > threshold else ""
+        print(f"{entry['name']:40s} {previous['median']:10.4f}s -> {entry['median']:10.4f}s  x{ratio:.2f} {flag}")
+        if ratio > threshold:
+            regressions.append(entry["name"])
+    return regressions
+
+
+GROUPS = ("startup", "ingest", "memory", "aggregation", "features", "forecast", "web")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the weather pipeline.")
+    parser.add_argument("--only", nargs="*", choices=GROUPS, default=list(GROUPS), help="Benchmark groups to run.")
+    parser.add_argument("--repeat", type=int, default=3, help="Measured runs per benchmark.")
+    parser.add_argument("--years", type=int, default=60, help="Years of synthetic data.")
+    parser.add_argument("--stations", type=int, default=50, help="Stations of synthetic data.")
+    parser.add_argument("--requests", type=int, default=400, help="Requests per web route.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent web clients.")
+    parser.add_argument("--sarima", action="store_true", help="Also fit the SARIMA model (slow).")
+    parser.add_argument("--output", type=str, default="benchmark-results.json", help="JSON result file.")
+    parser.add_argument("--compare", type=str, default=None, help="Previous JSON result file to compare with.")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio reported as regression.")
+    args = parser.parse_args()
+
+    benchmarks = {
+        "startup": lambda: bench_startup(args.repeat),
+        "ingest": lambda: bench_ingest(args.repeat),
+        "memory": lambda: bench_memory(args.repeat, args.years, args.stations),
+        "aggregation": lambda: bench_aggregation(args.repeat, args.years, args.stations),
+        "features": lambda: bench_features(args.repeat),
+        "forecast": lambda: bench_forecast(args.repeat, args.sarima),
+        "web": lambda: bench_web(args.requests, args.concurrency),
+    }
+
+    results = []
+    for group in args.only:
+        for name, params, timing in benchmarks[group]():
+            results.append({"name": name, "params": params, **timing})
+            print(f"{name:40s} median {timing['median']:.4f}s")
+
+    with open(args.output, "w") as file:
+        json.dump({
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "results": results,
+        }, file, indent=2)
+    print(f"Benchmark results saved to {args.output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
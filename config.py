@@ -29,3 +29,80 @@ OPEN_METEO_API_TMPL = "https://archive-api.open-meteo.com/v1/era5?latitude={lat}
 DEFAULT_API = "OPEN_METEO_API"  
 
 
+################################
+# OPENWEATHERMAP_API (One Call "timemachine", one request per day)
+# API key must be kept in OS environment vars
+OPENWEATHERMAP_API_URL = "https://api.openweathermap.org/data/2.5/onecall/timemachine"
+OPENWEATHERMAP_API_KEY = os.getenv('OPENWEATHERMAP_API_KEY')
+# Calls per minute allowed by your subscription (free plan is 60, paid plans 600+)
+OPENWEATHERMAP_CALLS_PER_MINUTE = int(os.getenv('OPENWEATHERMAP_CALLS_PER_MINUTE', '60'))
+# Max number of requests in flight at the same time
+OPENWEATHERMAP_MAX_IN_FLIGHT = 8
+
+################################
+# HTTP response cache (see http_cache.py)
+# Raw API responses are kept in memory and on disk, so reruns do not call the API again
+HTTP_CACHE_DIR = "data/cache/http"
+# Responses older than this are fetched again (historical data never changes, recent days do)
+HTTP_CACHE_TTL_SEC = int(os.getenv('HTTP_CACHE_TTL_SEC', str(30 * 24 * 3600)))
+# Max size of compressed responses on disk, oldest used are evicted first
+HTTP_CACHE_MAX_DISK_BYTES = 512 * 1024 * 1024
+# Max number of responses kept in memory
+HTTP_CACHE_MEMORY_ENTRIES = 32
+
+################################
+# Data quality stage of the hourly data, run once at ingest (see quality.py)
+# How short gaps are filled: "interpolate" (linear), "ffill" (last value),
+# "climatology" (mean of the same hour of the same month) or "none"
+QUALITY_FILL = os.getenv('QUALITY_FILL', 'interpolate')
+# Longest run of missing hours that is filled, longer gaps stay missing
+QUALITY_MAX_GAP_HOURS = 6
+# Days with fewer hours of data (after filling) are left out of the daily values
+QUALITY_MIN_HOURS_PER_DAY = 18
+# Plausible 2 m temperatures (°C), values outside are outliers
+QUALITY_LIMITS = (-80.0, 60.0)
+# Spikes: distance to the centered 25-hour median, in robust standard deviations
+QUALITY_SPIKE_Z = 8.0
+
+################################
+# Spatial grid mode (see grid.py)
+# Folder of the grid stores, one sub folder per bounding box, resolution and date range
+GRID_DIR = "data/grid"
+# Grid points per side of a chunk. A chunk is fetched in one multi-location request per year
+# and is the unit of work of the aggregation, so memory use depends on it and not on the grid size.
+GRID_CHUNK_POINTS = 8
+
+################################
+# Ensemble forecast (see ensemble.py)
+# Members: "linear" (forecast.py), "sarima" (forecast-sarima.py, left out until its model is trained)
+# and "random-forest" (forecast-random-forest.py). Each one runs in its own worker process.
+ENSEMBLE_MEMBERS = ("linear", "sarima", "random-forest")
+# Worker processes, None for as many as the CPUs (every backtest of every member is a task)
+ENSEMBLE_WORKERS = None
+# Backtests of each member (forecasts of the last blocks of days of the data), their errors weight the members
+ENSEMBLE_BACKTEST_FOLDS = 4
+# Fixed weights of the members whose backtests are not out of sample: the SARIMA model is fitted once
+# on all the data, so its backtest errors are too low. The other members share the rest by their backtests.
+ENSEMBLE_FIXED_WEIGHTS = {"sarima": 0.2}
+# Quantiles written next to the weighted mean forecast
+ENSEMBLE_QUANTILES = (0.1, 0.5, 0.9)
+
+################################
+# CSV exports of `Climate Change Main.py` (see csv_export.py)
+# None, "gzip" or "zstd" (needs the zstandard package); compressed files get a .gz/.zst suffix.
+# The web pages and pipeline.py read the uncompressed files, so keep None when using them.
+EXPORT_COMPRESSION = os.getenv('EXPORT_COMPRESSION') or None
+
+################################
+# Web pages and production server (see server.py)
+# Folder of the yearly-*.csv files shown on the plots page
+PLOTS_DATA_DIR = "data/19640101-20231231"
+# Seconds between background refreshes of the data, forecast and plots
+REFRESH_INTERVAL_SEC = int(os.getenv('REFRESH_INTERVAL_SEC', str(6 * 3600)))
+# pipeline.py arguments of each background refresh, run one after the other.
+# The forecast data ends today and is fetched again on every refresh into one folder
+# (data/<start>-latest); only the current year goes to the network, the other years are served by the HTTP cache.
+REFRESH_PIPELINES = [
+    ["forecast", "summarize", "--end", "today", "--force", "fetch"],
+    ["render", "--logic", "avg", "--start", "1964-01-01", "--end", "2023-12-31"],
+]
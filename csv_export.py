@@ -0,0 +1,194 @@
+import gzip
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+# File name suffix of each supported compression
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+# Same line ending as csv.writer, so files are identical to the ones written row by row
+LINE_TERMINATOR = b"\r\n"
+# gzip level of compressed exports (9 is much slower for little gain on CSV)
+GZIP_LEVEL = 6
+
+# Fields are built as rows of bytes in a matrix, NUL bytes are padding removed at the end
+PAD = 0
+
+
+def output_path(path, compression=None):
+    """
+    File name of `path` once compressed, e.g. daily-max.csv.gz.
+    """
+    if compression is None:
+        return path
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression '{compression}', expected one of {', '.join(COMPRESSIONS)}")
+    return path + COMPRESSIONS[compression]
+
+
+def digit_matrix(numbers, width=None, zero_pad=False):
+    """
+    Decimal digits of non-negative integers, one row per number, right aligned
+    and padded with PAD (or with zeros when `zero_pad`).
+    """
+    if width is None:
+        width = max(len(str(int(numbers.max()))), 1) if len(numbers) else 1
+    rest = numbers.astype(np.uint32 if width <= 9 else np.uint64)  # 32-bit division is faster
+    digits = np.empty((len(numbers), width), dtype=np.uint8)
+    for position in range(width - 1, -1, -1):
+        rest, digit = np.divmod(rest, 10)
+        digits[:, position] = digit
+    if not zero_pad:
+        significant = np.logical_or.accumulate(digits != 0, axis=1)
+        significant[:, -1] = True
+    digits += ord("0")
+    if not zero_pad:
+        digits[~significant] = PAD  # Leading zeros
+    return digits
+
+
+def format_integers(values):
+    values = values.astype(np.int64)
+    sign = np.where(values < 0, ord("-"), PAD).astype(np.uint8)[:, None]
+    return np.hstack([sign, digit_matrix(np.abs(values))])
+
+
+def format_decimals(values, decimals):
+    """
+    Floats rounded to `decimals`, written like Python writes the rounded float (3.4, 12.35, 3.0),
+    with trailing zeros dropped. NaN gives an empty field.
+    Exact ties (x.xx5 in binary) may round to the other side than round() does.
+    """
+    missing = np.isnan(values)
+    scale = 10 ** decimals
+    scaled = np.rint(np.abs(np.where(missing, 0, values)) * scale).astype(np.int64)
+    sign = np.where((values < 0) & (scaled > 0), ord("-"), PAD).astype(np.uint8)[:, None]
+    whole = digit_matrix(scaled // scale)
+    point = np.full((len(values), 1), ord("."), dtype=np.uint8)
+    fraction = digit_matrix(scaled % scale, max(decimals, 1), zero_pad=True)
+    if decimals > 0:
+        significant = np.flip(np.logical_or.accumulate(np.flip(fraction != ord("0"), 1), 1), 1)
+        significant[:, 0] = True
+        fraction[~significant] = PAD
+    field = np.hstack([sign, whole, point, fraction])
+    field[missing] = PAD
+    return field
+
+
+def format_dates(values):
+    """
+    Dates as YYYY-MM-DD; NaT gives an empty field.
+    """
+    days = values.astype("datetime64[D]")
+    missing = np.isnat(days)
+    months = days.astype("datetime64[M]")
+    dash = np.full((len(days), 1), ord("-"), dtype=np.uint8)
+    field = np.hstack([
+        digit_matrix(np.where(missing, 0, days.astype("datetime64[Y]").astype(np.int64) + 1970), 4, True), dash,
+        digit_matrix(np.where(missing, 0, months.astype(np.int64) % 12 + 1), 2, True), dash,
+        digit_matrix(np.where(missing, 0, (days - months).astype(np.int64) + 1), 2, True),
+    ])
+    field[missing] = PAD
+    return field
+
+
+def text_matrix(text):
+    """
+    Strings as a matrix of UTF-8 bytes, one row per string.
+    """
+    if text.dtype.kind == "U":
+        codes = text.view(np.uint32).reshape(len(text), -1)
+        # ASCII (the common case) is converted in one operation, other text is encoded string by string
+        text = codes.astype(np.uint8) if not np.any(codes > 127) else np.char.encode(text, "utf-8")
+    if text.dtype != np.uint8:
+        text = text.view(np.uint8).reshape(len(text), -1) if text.itemsize else np.zeros((len(text), 0), np.uint8)
+    if np.any((text == ord(",")) | (text == ord('"')) | (text == ord("\n"))):
+        raise ValueError("Values with commas, quotes or line breaks are not supported")
+    return text
+
+
+def format_column(values, decimals=None):
+    """
+    Format a whole column at once, as a matrix of bytes with one row per value.
+    Floats are rounded to `decimals` (written like Python's str(), e.g. 3.4); NaN and None
+    become empty fields, like csv.writer writes None. Values must not need CSV quoting.
+    """
+    array = np.asarray(values)
+    if array.dtype == object:
+        try:
+            array = array.astype(float)  # Numbers with None for missing values
+        except (TypeError, ValueError):
+            array = array.astype(str)
+
+    if array.dtype.kind == "b":
+        return text_matrix(np.where(array, b"True", b"False"))
+    if array.dtype.kind in "iu":
+        return format_integers(array)
+    if array.dtype.kind == "M":
+        return format_dates(array)
+    if array.dtype.kind == "f" and decimals is not None:
+        return format_decimals(array.astype(float), decimals)
+    if array.dtype.kind == "f":
+        # Full precision, written like Python's str() (no vectorized shortest representation in numpy)
+        return text_matrix(np.array([("" if value != value else str(value)) for value in array.tolist()], dtype=str))
+    return text_matrix(array.astype(str))
+
+
+def format_rows(columns, decimals=None):
+    """
+    CSV content (header included) of a dict {column name: values}, all columns of the same length.
+    """
+    header = ",".join(columns).encode() + LINE_TERMINATOR
+    fields = [format_column(values, decimals) for values in columns.values()]
+    rows = len(fields[0]) if fields else 0
+    separator = np.full((rows, 1), ord(","), dtype=np.uint8)
+    end = np.tile(np.frombuffer(LINE_TERMINATOR, dtype=np.uint8), (rows, 1))
+    parts = []
+    for field in fields:
+        parts += [field, separator]
+    matrix = np.hstack(parts[:-1] + [end]) if fields else np.zeros((0, 0), np.uint8)
+    return header + matrix[matrix != PAD].tobytes()
+
+
+def write_bytes(path, content, compression=None):
+    if compression == "gzip":
+        content = gzip.compress(content, compresslevel=GZIP_LEVEL)
+    elif compression == "zstd":
+        try:
+            import zstandard  # Optional dependency
+        except ImportError:
+            raise RuntimeError("zstd compression needs the zstandard package (pip install zstandard)")
+        content = zstandard.ZstdCompressor().compress(content)
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+@contextmanager
+def atomic_write(path):
+    """
+    Yield a temp file path next to `path` to write to, renamed to `path` when the block succeeds
+    (and removed when it fails), so readers see either the previous file or the complete new one.
+    The temp name has the process and thread ids, so concurrent writers never share it.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_csv(path, columns, decimals=None, compression=None):
+    """
+    Write a dict {column name: values} as a CSV file in one go, optionally gzip/zstd compressed.
+    The file is replaced atomically (see `atomic_write`), so readers such as the web server never see a partial file.
+    Returns the path written, with the compression suffix.
+    """
+    path = output_path(path, compression)
+    content = format_rows(columns, decimals)
+    with atomic_write(path) as tmp_path:
+        write_bytes(tmp_path, content, compression)
+    return path
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+# Day numbers count the days since this date
+EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def day_number(value):
+    """
+    Day number of a date given as an ISO string, datetime, Timestamp or datetime64.
+    """
+    return int((np.datetime64(pd.Timestamp(value).date(), "D") - EPOCH).astype(np.int64))
+
+
+class DailySeries:
+    """
+    Compact daily temperature series: one float32 per calendar day from `start`
+    (an int32 day number) on, NaN for days without data.
+    Costs 4 bytes per day instead of a dict and a date string per day, and since the days
+    are contiguous, selecting a date range is index arithmetic and returns a view (O(1)).
+    """
+
+    __slots__ = ("start", "values")
+
+    def __init__(self, start, values):
+        self.start = np.int32(start)
+        self.values = np.asarray(values, dtype=np.float32)
+
+    @classmethod
+    def from_days(cls, days, values):
+        """
+        Series from day numbers and values in any order; days missing in between are NaN.
+        """
+        days = np.asarray(days, dtype=np.int64)
+        if len(days) == 0:
+            return cls(0, [])
+        first = days.min()
+        dense = np.full(days.max() - first + 1, np.nan, dtype=np.float32)
+        dense[days - first] = values
+        return cls(first, dense)
+
+    @classmethod
+    def from_dates(cls, dates, values):
+        """
+        Series from dates (ISO strings or datetime64) and values.
+        """
+        days = np.asarray(dates, dtype="datetime64[D]") - EPOCH
+        return cls.from_days(days.astype(np.int64), values)
+
+    @classmethod
+    def from_hourly(cls, times, temperatures, how="max", decimals=None):
+        """
+        Daily `max`, `min` or `avg` of hourly temperatures, grouped by the date part of `times`
+        (ISO strings like 2024-01-31T13:00). NaN temperatures are ignored.
+        With `decimals` the daily values are rounded before they are stored as float32.
+        """
+        temperatures = np.asarray(temperatures, dtype=float)
+        valid = ~np.isnan(temperatures)
+        days = (np.asarray(times, dtype="datetime64[m]").astype("datetime64[D]") - EPOCH).astype(np.int64)[valid]
+        temperatures = temperatures[valid]
+        if len(days) == 0:
+            return cls(0, [])
+
+        first = days.min()
+        index = days - first
+        size = days.max() - first + 1
+        counts = np.bincount(index, minlength=size)
+        if how == "avg":
+            with np.errstate(invalid="ignore"):
+                result = np.bincount(index, weights=temperatures, minlength=size) / counts
+        else:
+            func = np.minimum if how == "min" else np.maximum
+            result = np.full(size, np.inf if how == "min" else -np.inf)
+            func.at(result, index, temperatures)
+        result[counts == 0] = np.nan
+        if decimals is not None:
+            # Built-in round() rounds ties on the exact binary value, unlike np.round; there are few days
+            result = np.array([round(value, decimals) for value in result.tolist()])
+        return cls(first, result + 0.0)  # + 0.0 turns -0.0 into 0.0
+
+    @classmethod
+    def read_csv(cls, file_name):
+        """
+        Read a daily CSV file with `Date` and `TEMPERATURE` columns (as written by `Climate Change Main.py`).
+        """
+        data = pd.read_csv(file_name)
+        data.columns = data.columns.str.strip().str.lower()
+        dates = pd.to_datetime(data["date"]).to_numpy().astype("datetime64[D]")
+        return cls.from_dates(dates, pd.to_numeric(data["temperature"], errors="coerce").to_numpy())
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def end(self):
+        """
+        Day number after the last day.
+        """
+        return int(self.start) + len(self.values)
+
+    @property
+    def days(self):
+        return np.arange(self.start, self.end, dtype=np.int32)
+
+    @property
+    def dates(self):
+        return EPOCH + self.days.astype("timedelta64[D]")
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    def count(self):
+        """
+        Number of days with data.
+        """
+        return int(np.count_nonzero(~np.isnan(self.values)))
+
+    def between(self, start_date, end_date):
+        """
+        Days from `start_date` to `end_date` (both included), sharing memory with this series.
+        """
+        first = min(max(day_number(start_date), int(self.start)), self.end)
+        last = min(max(day_number(end_date) + 1, first), self.end)
+        return DailySeries(first, self.values[first - self.start:last - self.start])
+
+    def round(self, decimals=2):
+        return DailySeries(self.start, np.round(self.values, decimals))
+
+    def items(self):
+        """
+        (ISO date, temperature) of the days with data, in date order.
+        """
+        valid = ~np.isnan(self.values)
+        dates = np.datetime_as_string(self.dates[valid], unit="D")
+        return zip(dates.tolist(), self.values[valid].tolist())
+
+    def to_series(self, name="TEMPERATURE"):
+        """
+        pandas Series (float64) indexed by `Date` with a daily frequency, including the NaN days.
+        """
+        index = pd.date_range(self.dates[0] if len(self) else EPOCH, periods=len(self), freq="D", name="Date")
+        return pd.Series(self.values.astype(float), index=index, name=name)
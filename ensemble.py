@@ -0,0 +1,251 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+import config
+import csv_export
+import instrumentation
+import trends
+from daily_series import DailySeries
+from scripts import load_script
+
+FORECAST_FILE = "data/forecast_output.csv"
+# Column of each member in the forecast file
+LABELS = {"linear": "Linear", "sarima": "SARIMA", "random-forest": "Random Forest"}
+# Probabilities of the normal samples of the members without their own distribution of forecasts
+PROBABILITIES = np.arange(1, 100) / 100
+
+
+def history(daily):
+    """
+    Input shared by all members: the daily temperatures as a Series indexed by date
+    with a value every day (days without data are interpolated).
+    """
+    return daily.to_series("T").interpolate(method="time").dropna()
+
+
+def normal_samples(mean, sd):
+    """
+    Samples (len(PROBABILITIES), days) of normal distributions of every day, at fixed probabilities.
+    """
+    from scipy.stats import norm  # Imported on use, it is slow to load
+    return np.asarray(mean) + np.outer(norm.ppf(PROBABILITIES), sd)
+
+
+# Members: function(series, days) -> (mean of every day, samples (n, days) or None)
+
+def linear_member(series, days):
+    """
+    Linear trend of the complete years plus the day of year variation (forecast.py).
+    """
+    linear = load_script("forecast.py", "forecast_linear")
+    table = trends.yearly_table(series.to_frame())
+    complete = table["complete"]["T"].to_numpy()
+    yearly = pd.DataFrame({"Year": table["mean"].index[complete], "T_Y_AVG": table["mean"]["T"].to_numpy()[complete]})
+    if len(yearly) < 2:
+        raise ValueError("the linear trend needs at least 2 complete years")
+    forecast = linear.trend_forecast(series.reset_index(), yearly, days)
+    return forecast["Predicted Temperature (°C)"].to_numpy(dtype=float), None
+
+
+def sarima_member(series, days, model):
+    """
+    SARIMA model trained by forecast-sarima.py, run from the end of `series` without refitting.
+    """
+    sarima = load_script("forecast-sarima.py", "forecast_sarima")
+    mean, sd = sarima.forecast_from(model, series.to_numpy(), days)
+    return mean, normal_samples(mean, sd)
+
+
+def random_forest_member(series, days):
+    """
+    Random forest of forecast-random-forest.py, forecasting day after day; every tree gives a sample.
+    """
+    random_forest = load_script("forecast-random-forest.py", "forecast_random_forest")
+    temperatures = series.to_numpy()
+    X, complete = random_forest.lagged_features(temperatures, series.index)
+    model = random_forest.train_model(X[complete], temperatures[complete])
+    paths = random_forest.forecast_paths(model, temperatures, series.index[-1], days)
+    return paths.mean(axis=0), paths
+
+
+MEMBERS = {"linear": linear_member, "sarima": sarima_member, "random-forest": random_forest_member}
+
+
+def backtest_ends(length, days, folds):
+    """
+    Ends of the training data of the backtests: each of the last `folds` blocks of `days` days
+    is forecast from the data before it.
+    """
+    return [length - days * fold for fold in range(folds, 0, -1) if length - days * fold > days]
+
+
+def run_member(name, daily, days, end, model_file):
+    """
+    Forecast of one member from the data before day `end` (None for all the data), run in a worker process.
+    Returns a dict with the forecast `mean`, its `samples` (n, days) or None, the `actual` temperatures
+    of the forecast days for a backtest and the `seconds` it took.
+    """
+    started = time.perf_counter()
+    member = MEMBERS[name]
+    if name == "sarima":
+        if not os.path.exists(model_file):
+            raise FileNotFoundError(f"no trained model {model_file}, run forecast-sarima.py first")
+        import joblib  # Imported on use, it is slow to load
+        member = partial(sarima_member, model=joblib.load(model_file))
+
+    series = history(daily)
+    with instrumentation.stage(f"ensemble_{name}", rows_in=len(series) if end is None else end) as stage:
+        mean, samples = member(series.iloc[:end], days)
+        stage.rows_out = days
+    return {"mean": np.asarray(mean, dtype=float), "samples": samples,
+            "actual": None if end is None else series.to_numpy()[end:end + days],
+            "seconds": time.perf_counter() - started}
+
+
+def backtest_weights(errors, fixed=config.ENSEMBLE_FIXED_WEIGHTS):
+    """
+    Weights of the members {name: errors}. The members in `fixed` get their fixed weight and the others
+    share the rest, inversely proportional to their backtest mean squared error
+    (equally when one of them has no backtest).
+    """
+    fixed = {name: weight for name, weight in fixed.items() if name in errors}
+    weighted = [name for name in errors if name not in fixed]
+    if not weighted:
+        return {name: 1 / len(errors) for name in errors}
+    share = max(1 - sum(fixed.values()), 0)
+    if any(len(errors[name]) == 0 for name in weighted):
+        inverse = np.ones(len(weighted))
+    else:
+        inverse = np.array([1 / max(np.mean(errors[name] ** 2), 1e-9) for name in weighted])
+    weights = {**fixed, **dict(zip(weighted, share * inverse / inverse.sum()))}
+    total = sum(weights.values())
+    return {name: weights[name] / total for name in errors}
+
+
+def weighted_quantiles(samples, weights, quantiles):
+    """
+    Quantiles of every day of the mixture of the members' samples, each member counting for its weight
+    whatever its number of samples. `samples` is a list of arrays (n, days). Returns an array (quantiles, days).
+    """
+    values = np.vstack(samples)
+    sample_weights = np.concatenate([np.full(len(member), weight / len(member))
+                                     for member, weight in zip(samples, weights)])
+    order = np.argsort(values, axis=0)
+    values = np.take_along_axis(values, order, axis=0)
+    ordered_weights = sample_weights[order]
+    # Cumulative weight at the middle of every sample, so the quantiles are interpolated between samples
+    cumulative = (np.cumsum(ordered_weights, axis=0) - ordered_weights / 2) / ordered_weights.sum(axis=0)
+    return np.array([[np.interp(quantile, cumulative[:, day], values[:, day]) for day in range(values.shape[1])]
+                     for quantile in quantiles])
+
+
+def ensemble_forecast(file_name, days=10, members=config.ENSEMBLE_MEMBERS, folds=config.ENSEMBLE_BACKTEST_FOLDS,
+                      quantiles=config.ENSEMBLE_QUANTILES, workers=config.ENSEMBLE_WORKERS):
+    """
+    Forecast the `days` after a daily CSV file (e.g. daily-max.csv) with all members at once.
+    The file is read once and the backtests and forecasts of the members run in parallel worker processes
+    on the same input, so with enough CPUs the forecast takes as long as the slowest model fit
+    instead of the sum of all.
+    The SARIMA member uses the model trained by forecast-sarima.py next to the file and is left out without it.
+    Returns (forecast, report): `forecast` has `Date`, the weighted mean `Predicted Temperature (°C)`,
+    the quantiles (P10 (°C)...) and the forecast of each member; `report` has the weights and backtest errors.
+    """
+    daily = DailySeries.read_csv(file_name)
+    if daily.count() == 0:
+        print(f"Error: No temperature data in '{file_name}'!")
+        return None, None
+    model_file = file_name.rsplit('.', 1)[0] + '_sarima.pkl'
+
+    ends = backtest_ends(len(history(daily)), days, folds)
+
+    # Every backtest and forecast of every member is a task of its own, so the slow members are spread
+    # over the workers too. Spawned workers do not inherit the threads and locks of the parent
+    # (pipeline.py runs its stages in threads).
+    workers = workers or min(len(members) * (len(ends) + 1), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {name: [pool.submit(run_member, name, daily, days, end, model_file) for end in ends + [None]]
+                   for name in members}
+        results = {}
+        for name, member_futures in futures.items():
+            try:
+                *backtests, final = [future.result() for future in member_futures]
+            except Exception as e:
+                print(f"Ensemble member '{name}' left out: {e}")
+                continue
+            errors = np.array([backtest["mean"] - backtest["actual"] for backtest in backtests]).reshape(-1, days)
+            if final["samples"] is None:
+                # Normal distribution with the backtest error of every day ahead
+                final["samples"] = normal_samples(final["mean"], np.sqrt(np.mean(errors ** 2, axis=0))
+                                                  if len(errors) else np.zeros(days))
+            results[name] = {**final, "errors": errors,
+                             "seconds": sum(result["seconds"] for result in backtests + [final])}
+    if not results:
+        print("Error: No ensemble member could forecast!")
+        return None, None
+
+    weights = backtest_weights({name: result["errors"] for name, result in results.items()})
+    mean = sum(weights[name] * result["mean"] for name, result in results.items())
+    bands = weighted_quantiles([result["samples"] for result in results.values()], list(weights.values()), quantiles)
+
+    forecast = pd.DataFrame({
+        "Date": daily.dates[-1] + np.arange(1, days + 1).astype("timedelta64[D]"),
+        "Predicted Temperature (°C)": mean,
+        **{f"P{round(quantile * 100)} (°C)": band for quantile, band in zip(quantiles, bands)},
+        **{f"{LABELS[name]} (°C)": result["mean"] for name, result in results.items()},
+    })
+    report = {
+        "file": file_name,
+        "days": days,
+        "backtests": folds,
+        "members": {name: {
+            "weight": round(float(weights[name]), 4),
+            "fixed_weight": name in config.ENSEMBLE_FIXED_WEIGHTS,
+            "backtest_rmse": round(float(np.sqrt(np.mean(result["errors"] ** 2))), 3) if result["errors"].size else None,
+            "task_seconds": round(result["seconds"], 2),
+        } for name, result in results.items()},
+    }
+    return forecast, report
+
+
+def write_forecast(forecast, report, forecast_file=FORECAST_FILE):
+    """
+    Write the forecast for app.py (replacing the previous file atomically) and the report next to it.
+    """
+    output_file = csv_export.write_csv(forecast_file, {column: forecast[column].to_numpy() for column in forecast.columns},
+                                       decimals=2)
+    with open(forecast_file.replace(".csv", "-ensemble.json"), "w") as file:
+        json.dump(report, file, indent=1)
+    print(f"Ensemble forecast saved to {output_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Ensemble forecast of the linear, SARIMA and random forest models, weighted by their backtests.")
+    parser.add_argument("--file", type=str, default="data/20100101-20241205/daily-max.csv",
+                        help="Daily CSV file (Date, TEMPERATURE) to forecast from.")
+    parser.add_argument("--days", type=int, default=10, help="Number of days to forecast.")
+    parser.add_argument("--members", nargs="+", choices=list(MEMBERS), default=list(config.ENSEMBLE_MEMBERS),
+                        help="Models of the ensemble.")
+    parser.add_argument("--backtests", type=int, default=config.ENSEMBLE_BACKTEST_FOLDS,
+                        help="Backtests of each member used to weight them.")
+    parser.add_argument("--workers", type=int, default=config.ENSEMBLE_WORKERS, help="Worker processes.")
+    args = parser.parse_args()
+
+    with instrumentation.stage("forecast_ensemble") as stage:
+        ensemble, ensemble_report = ensemble_forecast(args.file, args.days, args.members, args.backtests,
+                                                      workers=args.workers)
+        stage.rows_out = 0 if ensemble is None else len(ensemble)
+
+    if ensemble is not None:
+        for member_name, member in ensemble_report["members"].items():
+            print(f"{member_name}: weight {member['weight']:.2f}, backtest RMSE {member['backtest_rmse']}°C")
+        print(ensemble.to_string(index=False, float_format="{:.2f}".format))
+        write_forecast(ensemble, ensemble_report)
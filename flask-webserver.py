@@ -1,25 +1,44 @@
 import os
-import requests
-import pandas as pd
-import matplotlib.pyplot as plt
-from flask import Flask, render_template, send_file
+from flask import Blueprint, Flask, current_app, render_template, send_from_directory
 import glob
+import config
+import instrumentation
 
-# Initialize Flask app
-app = Flask(__name__)
+# Plot routes, mounted by this app and by the combined production server (server.py)
+bp = Blueprint('plots', __name__, template_folder='templates')
 
 # Create 'static' directory if not exists
 if not os.path.exists('static'):
     os.makedirs('static')
 
+def plot_path_for(csv_file):
+    return f"static/{os.path.basename(csv_file).replace('.csv', '-plot.png')}"
+
 # Helper function to generate plots from CSV data
-def generate_plot(folder_path):
+def generate_plot(folder_path, force=False):
     # Get all CSV files in the folder that match the pattern "yearly-<calc_logic>.csv"
     csv_files = glob.glob(os.path.join(folder_path, 'yearly-*.csv'))
     if not csv_files:
         return None  # No matching CSV files found
-    
-    plot_paths = []  # List to hold paths of generated plots
+
+    # Plots newer than their CSV file are reused, so pandas and matplotlib are only
+    # imported when a plot really has to be drawn
+    stale_files = [
+        csv_file for csv_file in csv_files
+        if force or not os.path.exists(plot_path_for(csv_file))
+        or os.path.getmtime(plot_path_for(csv_file)) < os.path.getmtime(csv_file)
+    ]
+    if stale_files:
+        draw_plots(stale_files)
+
+    return [plot_path_for(csv_file) for csv_file in csv_files if os.path.exists(plot_path_for(csv_file))]
+
+def draw_plots(csv_files):
+    import pandas as pd
+    import matplotlib
+    matplotlib.use('Agg')  # No display in web server
+    import matplotlib.pyplot as plt
+    import rolling
 
     for csv_file in csv_files:
         # Read CSV data into pandas DataFrame
@@ -33,7 +52,7 @@ def generate_plot(folder_path):
         print(f"Processing {csv_file} with columns: {data.columns}")
 
         # Calculate the 5-year moving average of the temperature
-        data['5-Year Moving Avg'] = data['TEMPERATURE'].rolling(window=5).mean()
+        data['5-Year Moving Avg'] = rolling.rolling_mean(data['TEMPERATURE'].to_numpy(), 5)
 
         # Determine the dynamic range for the X-axis based on the years
         min_year = data['Year'].min()-1
@@ -65,21 +84,23 @@ def generate_plot(folder_path):
         ax2.legend(loc='upper right')
 
         # Save the plot as an image
-        plot_path = f"static/{os.path.basename(csv_file).replace('.csv', '-plot.png')}"
-        plt.savefig(plot_path)
+        plt.savefig(plot_path_for(csv_file))
         plt.close()
 
-        plot_paths.append(plot_path)  # Add the plot path to the list
-
-    return plot_paths  # Return a list of plot paths
-
 # Route to handle the main page and display plots
-@app.route('/')
+@bp.route('/')
 def index():
     # Specify the folder path containing the CSV files (adjust as needed)
-    folder_path =  'data/19640101-20231231'
+    folder_path = config.PLOTS_DATA_DIR
     
-    plot_paths = generate_plot(folder_path)
+    if current_app.config.get('PRECOMPUTED_ONLY'):
+        # Plots are drawn by the background refresh, requests only list the existing images
+        plot_paths = [path for path in map(plot_path_for, glob.glob(os.path.join(folder_path, 'yearly-*.csv')))
+                      if os.path.exists(path)]
+    else:
+        with instrumentation.stage("render_plots") as stage:
+            plot_paths = generate_plot(folder_path)
+            stage.rows_out = len(plot_paths or [])
     
     if not plot_paths:
         return "No data found to generate plots.", 404
@@ -89,10 +110,14 @@ def index():
 
 # Route to send the plot image as a response
 
-@app.route('/static/<plot_filename>')
+@bp.route('/static/<plot_filename>')
 def plot(plot_filename):
-    plot_path = f"static/{plot_filename}"
-    return send_file(plot_path, mimetype='image/png')
+    return send_from_directory(os.path.abspath('static'), plot_filename, mimetype='image/png')
+
+# Initialize Flask app
+app = Flask(__name__)
+app.register_blueprint(bp)
+instrumentation.instrument_app(app)  # Adds /metrics
 
 # Run the Flask app on port 8080
 if __name__ == '__main__':
@@ -2,11 +2,10 @@
 import os
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_squared_error
-import matplotlib.pyplot as plt
-import joblib  # For saving and loading models
+import rolling
+import daily_series
+import quality
+import instrumentation
 
 def load_and_parse_csv(file_name):
     """
@@ -14,18 +13,25 @@ def load_and_parse_csv(file_name):
     It handles two file formats: daily-avg.csv and openmeteo CSV.
     """
     try:
-        # Load the data and inspect the columns
-        data = pd.read_csv(file_name, skip_blank_lines=False)
-        print(f"Loaded {file_name} with columns: {data.columns.tolist()}")
+        if "daily" in file_name:
+            # Compact typed series, one float32 per calendar day
+            daily = daily_series.DailySeries.read_csv(file_name)
+            print(f"Loaded {file_name} with {daily.count()} days")
+        elif "openmeteo" in file_name:
+            # Hourly cache, the hours of incomplete days are left out by the quality stage
+            data = quality.load_hourly(file_name)
+            print(f"Loaded {file_name} with columns: {data.columns.tolist()}")
+        else:
+            # Load the data and inspect the columns
+            data = pd.read_csv(file_name, skip_blank_lines=False)
+            print(f"Loaded {file_name} with columns: {data.columns.tolist()}")
     except FileNotFoundError:
         print(f"Error: File '{file_name}' not found!")
         return None
 
     # Handle daily format
     if "daily" in file_name:
-        data.columns = data.columns.str.strip().str.lower()
-        data["Date"] = pd.to_datetime(data["date"])
-        data = data.rename(columns={"temperature": "T"})
+        data = daily.to_series("T").reset_index()
         data["DayOfYear"] = data["Date"].dt.dayofyear
         data = data[["Date", "T", "DayOfYear"]]
 
@@ -52,10 +58,10 @@ def prepare_features(data):
     for lag in range(1, 11):
         data[f'T_Lag_{lag}'] = data['T'].shift(lag)
 
-    # Add moving averages
-    data['T_MA_3'] = data['T'].rolling(window=3).mean()
-    data['T_MA_5'] = data['T'].rolling(window=5).mean()
-    data['T_MA_10'] = data['T'].rolling(window=10).mean()
+    # Add moving averages (all windows computed in one pass)
+    moving_avgs = rolling.rolling_stats(data['T'].to_numpy(), (3, 5, 10), ("mean",))
+    for window in (3, 5, 10):
+        data[f'T_MA_{window}'] = moving_avgs[("mean", window)]
 
     # Add seasonal features
     data['DayOfYear'] = data['Date'].dt.dayofyear
@@ -73,6 +79,7 @@ def train_model(X, y):
     """
     Train the Random Forest model using the provided features (X) and target (y).
     """
+    from sklearn.ensemble import RandomForestRegressor  # Imported on use, it is slow to load
     model = RandomForestRegressor(n_estimators=100, random_state=42)
     model.fit(X, y)
     return model
@@ -81,6 +88,7 @@ def evaluate_model(model, X, y):
     """
     Evaluate the model performance using mean squared error.
     """
+    from sklearn.metrics import mean_squared_error
     y_pred = model.predict(X)
     mse = mean_squared_error(y, y_pred)
     return mse
@@ -89,6 +97,7 @@ def plot_predictions(data, model):
     """
     Plot the actual vs predicted temperature values.
     """
+    import matplotlib.pyplot as plt
     X, y = prepare_features(data)
     y_pred = model.predict(X)
     
@@ -104,39 +113,104 @@ def plot_predictions(data, model):
     plt.legend()
     plt.show()
 
+LAGS = 10
+MOVING_AVG_WINDOWS = (3, 5, 10)
+
+def lagged_features(temperatures, dates):
+    """
+    Features of every day from the days before it only: the last LAGS temperatures,
+    the moving averages ending the day before and the day of year.
+    Unlike `prepare_features`, the day's own temperature is not used, so a model trained
+    on them can forecast one day after the other (see `forecast_paths`).
+    Returns the feature matrix and the mask of the days that have all their features.
+    """
+    temperatures = np.asarray(temperatures, dtype=float)
+    previous = np.r_[np.nan, temperatures[:-1]]
+    lags = [np.r_[np.full(lag, np.nan), temperatures[:-lag]] for lag in range(1, LAGS + 1)]
+    moving_avgs = rolling.rolling_stats(previous, MOVING_AVG_WINDOWS, ("mean",))
+    X = np.column_stack([pd.DatetimeIndex(dates).dayofyear] + lags +
+                        [moving_avgs[("mean", window)] for window in MOVING_AVG_WINDOWS])
+    return X, ~np.isnan(X).any(axis=1)
+
+def forecast_paths(model, temperatures, last_date, days=10):
+    """
+    Forecast the `days` after `last_date` one day at a time, feeding the predictions back as lags.
+    The features of every day come from `lagged_features`, like in training.
+    Every tree of the forest follows its own path, so the spread of the paths
+    is a distribution of the forecast. Returns an array (trees, days).
+    """
+    trees = model.estimators_
+    # The last LAGS days are all the features of the next day need
+    dates = pd.date_range(end=last_date + pd.Timedelta(days=days), periods=LAGS + days)
+    paths = np.full((len(trees), LAGS + days), np.nan)
+    paths[:, :LAGS] = np.asarray(temperatures[-LAGS:], dtype=float)
+    for day in range(LAGS, LAGS + days):
+        # The last LAGS + 1 days of all the paths one after the other: the features of the last day
+        # of each block only come from its own path
+        blocks = paths[:, day - LAGS:day + 1]
+        X, _ = lagged_features(blocks.ravel(), np.tile(dates[day - LAGS:day + 1], len(trees)))
+        X = X[LAGS::LAGS + 1]
+        paths[:, day] = [tree.predict(X[i:i + 1])[0] for i, tree in enumerate(trees)]
+    return paths[:, LAGS:]
+
+def daily_history(data):
+    """
+    Temperatures of every calendar day of the loaded data (one or more rows per day),
+    days without data interpolated, as a Series indexed by date.
+    """
+    series = data.groupby("Date")["T"].mean()
+    return series.asfreq("D").interpolate(method="time").dropna()
+
+def forecast_next_days(model, series, days=10):
+    """
+    Forecast the `days` after the end of the daily `series` with a model trained on `lagged_features`:
+    the mean of the paths of the trees (see `forecast_paths`).
+    Returns a DataFrame with `Date` and `Predicted Temperature (°C)`.
+    """
+    paths = forecast_paths(model, series.to_numpy(), series.index[-1], days)
+    next_dates = series.index[-1] + pd.to_timedelta(np.arange(1, days + 1), unit="D")
+    return pd.DataFrame({
+        "Date": next_dates.strftime('%Y-%m-%d'),
+        "Predicted Temperature (°C)": paths.mean(axis=0).round(2),
+    })
+
 def main(file_names):
     # Load data from CSV files
     
     # Load and combine data
-    data_frames = [load_and_parse_csv(file) for file in file_names]
-    combined_data = pd.concat(data_frames, ignore_index=True)
+    with instrumentation.stage("load") as stage:
+        data_frames = [load_and_parse_csv(file) for file in file_names]
+        combined_data = pd.concat(data_frames, ignore_index=True)
+        stage.rows_out = len(combined_data)
     
-    # Prepare features and target for training
-    combined_data, X, y = prepare_features(combined_data)
+    # Prepare features and target for training, from the days before each day only
+    with instrumentation.stage("features", rows_in=len(combined_data)) as stage:
+        series = daily_history(combined_data)
+        X, complete = lagged_features(series.to_numpy(), series.index)
+        X, y = X[complete], series.to_numpy()[complete]
+        stage.rows_out = len(X)
     
     # Train the Random Forest model
-    model = train_model(X, y)
+    with instrumentation.stage("train_random_forest", rows_in=len(X)):
+        model = train_model(X, y)
     
     # Evaluate the model
-    mse = evaluate_model(model, X, y)
+    with instrumentation.stage("evaluate", rows_in=len(X)):
+        mse = evaluate_model(model, X, y)
     print(f"Model Mean Squared Error: {mse}")
     
     # Predict the next 10 days
     print("Preparing next 10 days of predictions...")
     
-    # Extract the last 10 rows of the dataset
-    recent_data = combined_data.iloc[-10:].copy()
-    X_recent = recent_data.drop(columns=['Date', 'T'])
-    predictions = model.predict(X_recent)
-    
-    # Calculate the next 10 dates
-    last_date = combined_data['Date'].max()
-    next_dates = [last_date + pd.Timedelta(days=i) for i in range(1, 11)]
+    with instrumentation.stage("forecast_random_forest", rows_in=10) as stage:
+        forecast_df = forecast_next_days(model, series, days=10)
+        stage.rows_out = len(forecast_df)
     
     # Print predictions with dates
     print("Next 10 Days Predictions:")
-    for date, prediction in zip(next_dates, predictions):
-        print(f"{date.strftime('%Y-%m-%d')}: {prediction:.2f}°C")
+    for date, prediction in zip(forecast_df["Date"], forecast_df["Predicted Temperature (°C)"]):
+        print(f"{date}: {prediction:.2f}°C")
+    return forecast_df
 
 # file_names = [ "data/20230101-20241204/daily-avg.csv", "data/20230101-20241204/openmeteo-20230101-20241204.csv" ]
 file_names = [ "data/20230101-20241204/openmeteo-20230101-20241204.csv" ]
@@ -1,51 +1,42 @@
 import os
-import joblib
+import numpy as np
 import pandas as pd
-from pmdarima import auto_arima
 import logging
+import daily_series
+import instrumentation
+import quality
 
 # Function to load and parse the CSV file
 def load_and_parse_csv(file_name):
     """
-    Loads, parses, and preprocesses the CSV file for temperature data.
-    It handles two file formats: daily-avg.csv and openmeteo CSV.
+    Loads and parses the CSV file for temperature data as a daily series.
+    It handles two file formats: daily-avg.csv and openmeteo CSV (averaged per day).
+    Gaps were checked and filled by the data quality stage at ingest, so the data is only
+    interpolated here when whole days are missing.
     """
     try:
-        # Load the data and inspect the columns
-        data = pd.read_csv(file_name, skip_blank_lines=False)
-        print(f"Loaded {file_name} with columns: {data.columns.tolist()}")
+        if "daily" in file_name:
+            # Compact typed series, one float32 per calendar day
+            daily = daily_series.DailySeries.read_csv(file_name)
+        elif "openmeteo" in file_name:
+            hourly = quality.load_hourly(file_name)
+            daily = daily_series.DailySeries.from_hourly(hourly["time"].to_numpy(), hourly["temperature"].to_numpy(), "avg")
+        else:
+            raise ValueError(f"Unknown file format for '{file_name}'.")
+        print(f"Loaded {file_name} with {daily.count()} days")
     except FileNotFoundError:
         print(f"Error: File '{file_name}' not found!")
         return None
 
-    # Handle daily format
-    if "daily" in file_name:
-        data.columns = data.columns.str.strip().str.lower()
-        data["Date"] = pd.to_datetime(data["date"])
-        data = data.rename(columns={"temperature": "T"})
-        data["DayOfYear"] = data["Date"].dt.dayofyear
-        data = data[["Date", "T", "DayOfYear"]]
+    # One row per calendar day, indexed by Date with a daily frequency
+    data = daily.to_series("T").to_frame()
+    data["DayOfYear"] = data.index.dayofyear
 
-    # Handle openmeteo CSV format
-    elif "openmeteo" in file_name:
-        data.columns = data.columns.str.strip().str.lower()
-        data["Date"] = pd.to_datetime(data["time"].str[:10])  # Extract date part
-        data["T"] = data["temperature"]
-        data["DayOfYear"] = data["Date"].dt.dayofyear
-        data = data[["Date", "T", "DayOfYear"]]
-
-    else:
-        raise ValueError(f"Unknown file format for '{file_name}'.")
-
-    # Drop rows with missing temperature values
-    data = data.dropna(subset=["T"])
-
-    # Set the Date column as index and enforce frequency
-    data.set_index("Date", inplace=True)  # Ensure Date is set as index
-    data = data.asfreq('D')  # Explicitly set daily frequency
-
-    # Fill minor gaps with interpolation if necessary
-    data['T'] = data['T'].interpolate(method='time')
+    # SARIMA needs a value every day; only gaps longer than the quality stage fills are left
+    missing_days = int(data["T"].isna().sum())
+    if missing_days:
+        print(f"Interpolating {missing_days} days without data")
+        data["T"] = data["T"].interpolate(method="time")
 
     return data
 
@@ -54,6 +45,10 @@ def train_model(data_daily, model_file):
     """
     Trains a SARIMA model or loads an existing one if available.
     """
+    # Imported on use, pmdarima and joblib are slow to load
+    import joblib
+    from pmdarima import auto_arima
+
     if os.path.exists(model_file):
         print(f"Loading pre-trained model from {model_file}...")
         return joblib.load(model_file)
@@ -101,18 +96,32 @@ def sarima_forecast(model, start_date, days):
     })
     return forecast_df
 
+# Function to forecast from other data with a trained model
+def forecast_from(model, temperatures, days):
+    """
+    Forecasts `days` after `temperatures` with the orders and coefficients of a trained model, without refitting:
+    only the state of the model is rebuilt from the given data (e.g. data ending earlier, for a backtest).
+    Returns the mean and the standard deviation of every forecast day.
+    """
+    results = model.arima_res_.apply(np.asarray(temperatures, dtype=float))
+    forecast = results.get_forecast(days)
+    return np.asarray(forecast.predicted_mean), np.sqrt(np.asarray(forecast.var_pred_mean))
+
 # Main function to tie it all together
 def main(file_name, model_file, days=5):
     """
     Main function to load data, train/load the model, and run forecasting.
     """
     # Load and parse the data
-    daily_data = load_and_parse_csv(file_name)
+    with instrumentation.stage("load") as stage:
+        daily_data = load_and_parse_csv(file_name)
+        stage.rows_out = 0 if daily_data is None else len(daily_data)
     if daily_data is None:
         return  # Exit if loading failed
     
     # Train or load the SARIMA model
-    model = train_model(daily_data['T'], model_file)
+    with instrumentation.stage("train_sarima", rows_in=len(daily_data)):
+        model = train_model(daily_data['T'], model_file)
     if model is None:
         print("Model training/loading failed. Exiting.")
         return
@@ -122,7 +131,9 @@ def main(file_name, model_file, days=5):
     start_date = max_date + pd.Timedelta(days=1)  # Start prediction from the next day
     
     # Perform SARIMA forecasting
-    forecast_df = sarima_forecast(model, start_date, days)
+    with instrumentation.stage("forecast_sarima") as stage:
+        forecast_df = sarima_forecast(model, start_date, days)
+        stage.rows_out = len(forecast_df)
     
     print(forecast_df)
     return forecast_df
@@ -1,8 +1,8 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from sklearn.linear_model import LinearRegression
 import argparse
+import instrumentation
 
 
 def forecast_next_days(file_name="data/output-20000101-20241123.csv", days=10):
@@ -45,7 +45,19 @@ def forecast_next_days(file_name="data/output-20000101-20241123.csv", days=10):
     yearly_data["T_Y_AVG"] = pd.to_numeric(yearly_data["T_Y_AVG"], errors="coerce")
     yearly_data = yearly_data.dropna()
 
+    return trend_forecast(daily_data, yearly_data, days)
+
+
+def trend_forecast(daily_data, yearly_data, days=10):
+    """
+    Linear trend of the yearly averages plus the daily variation of the day of year.
+    :param daily_data: DataFrame with `Date` (datetime) and `T` columns.
+    :param yearly_data: DataFrame with `Year` and `T_Y_AVG` (average temperature of complete years).
+    :param days: Number of days to forecast after the last date.
+    :return: DataFrame with `Date` and `Predicted Temperature (°C)`.
+    """
     # Prepare data for regression
+    from sklearn.linear_model import LinearRegression  # Imported on use, it is slow to load
     X = yearly_data["Year"].values.reshape(-1, 1)
     y = yearly_data["T_Y_AVG"].values
     model = LinearRegression()
@@ -58,9 +70,9 @@ def forecast_next_days(file_name="data/output-20000101-20241123.csv", days=10):
     # Find the last available date
     last_date_dt = daily_data['Date'].max()
 
-    # Historical daily variation by day of year
-    daily_data["DayOfYear"] = daily_data["Date"].dt.dayofyear
-    daily_variation = daily_data.groupby("DayOfYear")["T"].mean()
+    # Historical daily variation by day of year, relative to the mean of all days
+    day_of_year = daily_data["Date"].dt.dayofyear
+    daily_variation = daily_data.groupby(day_of_year)["T"].mean() - daily_data["T"].mean()
 
     # Forecast the next 'days' days
     forecast_dates = [(last_date_dt + timedelta(days=i)) for i in range(1, days + 1)]
@@ -93,7 +105,9 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     # Generate forecast
-    forecast = forecast_next_days(file_name=args.file, days=args.days)
+    with instrumentation.stage("forecast_linear") as stage:
+        forecast = forecast_next_days(file_name=args.file, days=args.days)
+        stage.rows_out = 0 if forecast is None else len(forecast)
 
     if forecast is not None:
         print("\nForecast for the next days:")
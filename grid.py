@@ -0,0 +1,257 @@
+import argparse
+import glob
+import json
+import os
+import warnings
+from contextlib import ExitStack
+
+import numpy as np
+import pandas as pd
+
+import config
+import csv_export
+import http_cache
+import instrumentation
+import trends
+
+# Yearly statistics of `calculate_yearly_averages`, one (year, lat, lon) array each
+YEARLY_STATS = ["TEMPERATURE", "CHANGE", "ANOMALY", "DAYS", "COMPLETE"]
+
+
+def grid_axes(bbox, resolution):
+    """
+    Latitudes and longitudes of the grid points covering `bbox` (south, west, north, east) every `resolution` degrees.
+    """
+    south, west, north, east = bbox
+    if south > north or west > east or resolution <= 0:
+        raise ValueError(f"Invalid bounding box {bbox} or resolution {resolution}")
+    lats = np.round(np.arange(south, north + resolution / 2, resolution), 4)
+    lons = np.round(np.arange(west, east + resolution / 2, resolution), 4)
+    return lats, lons
+
+
+def default_store(bbox, resolution, start_date, end_date):
+    name = "_".join(f"{value:g}" for value in (*bbox, resolution))
+    return os.path.join(config.GRID_DIR, f"{name}-{start_date.replace('-', '')}-{end_date.replace('-', '')}")
+
+
+def year_ranges(start_date, end_date):
+    """
+    (year, first day, last day) of every calendar year of the date range.
+    """
+    return [(year, max(start_date, f"{year}-01-01"), min(end_date, f"{year}-12-31"))
+            for year in range(int(start_date[:4]), int(end_date[:4]) + 1)]
+
+
+class GridStore:
+    """
+    Chunked (time x lat x lon) float32 arrays on disk.
+    The grid is cut in square chunks of `chunk` points per side, and every chunk is stored
+    per calendar year as `<name>-<year>-<i>-<j>.npy`, so any operation only needs one chunk in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "grid.json")) as file:
+            meta = json.load(file)
+        self.lats = np.array(meta["lats"])
+        self.lons = np.array(meta["lons"])
+        self.start_date = meta["start"]
+        self.end_date = meta["end"]
+        self.chunk = meta["chunk"]
+
+    @classmethod
+    def create(cls, path, lats, lons, start_date, end_date, chunk=config.GRID_CHUNK_POINTS):
+        os.makedirs(path, exist_ok=True)
+        meta = {"lats": lats.tolist(), "lons": lons.tolist(), "start": start_date, "end": end_date, "chunk": chunk}
+        with csv_export.atomic_write(os.path.join(path, "grid.json")) as tmp_path:
+            with open(tmp_path, "w") as file:
+                json.dump(meta, file, indent=1)
+        return cls(path)
+
+    @property
+    def shape(self):
+        return len(self.lats), len(self.lons)
+
+    def chunks(self):
+        """
+        (i, j, latitude slice, longitude slice) of every chunk.
+        """
+        for i in range(0, len(self.lats), self.chunk):
+            for j in range(0, len(self.lons), self.chunk):
+                yield i // self.chunk, j // self.chunk, slice(i, i + self.chunk), slice(j, j + self.chunk)
+
+    def chunk_file(self, name, year, i, j):
+        return os.path.join(self.path, f"{name}-{year}-{i}-{j}.npy")
+
+    def write(self, name, year, i, j, array):
+        """
+        Save one chunk (temp file and rename, so readers never see a partial chunk).
+        """
+        with csv_export.atomic_write(self.chunk_file(name, year, i, j)) as tmp_path:
+            with open(tmp_path, "wb") as file:
+                np.save(file, np.asarray(array, dtype=np.float32))
+
+    def read(self, name, year, i, j):
+        return np.load(self.chunk_file(name, year, i, j), mmap_mode="r")
+
+    def yearly_file(self, logic, stat):
+        return os.path.join(self.path, f"yearly-{logic}-{stat}.npy")
+
+
+def fetch_chunk(lats, lons, first_day, last_day):
+    """
+    Hourly temperatures of all points of a chunk in one multi-location request.
+    Returns a (hours, lat, lon) float32 array, NaN where the API has no value.
+    """
+    lat_grid, lon_grid = np.meshgrid(lats, lons, indexing="ij")
+    url = config.OPEN_METEO_API_TMPL.format(
+        lat=",".join(f"{lat:g}" for lat in lat_grid.ravel()),
+        long=",".join(f"{lon:g}" for lon in lon_grid.ravel()),
+        start_dt=first_day, end_dt=last_day,
+    )
+    # Not cached: a chunk response parses to tens of MB and the chunk files already make fetches resumable
+    locations = http_cache.get_json(url, remember=False)
+    if isinstance(locations, dict):
+        locations = [locations]  # A single point is not returned as a list
+    if len(locations) != lat_grid.size:
+        raise ValueError(f"Expected {lat_grid.size} locations, got {len(locations)}")
+
+    start = np.datetime64(f"{first_day}T00:00", "h")
+    hours = int((np.datetime64(last_day, "D") + 1 - np.datetime64(first_day, "D")).astype(np.int64)) * 24
+    values = np.full((hours, lat_grid.size), np.nan, dtype=np.float32)
+    for point, location in enumerate(locations):
+        hourly = location["hourly"]
+        index = (np.asarray(hourly["time"], dtype="datetime64[h]") - start).astype(np.int64)
+        temperatures = np.array(hourly["temperature_2m"], dtype=float)  # None becomes NaN
+        inside = (index >= 0) & (index < hours)
+        values[index[inside], point] = temperatures[inside]
+    return values.reshape(hours, len(lats), len(lons))
+
+
+def fetch_grid(bbox, resolution, start_date, end_date, store_dir=None, refresh=False):
+    """
+    Fetch the hourly temperatures of the grid covering `bbox` into a GridStore.
+    Chunks already on disk are kept unless `refresh`, so an interrupted fetch resumes where it stopped.
+    """
+    lats, lons = grid_axes(bbox, resolution)
+    store_dir = store_dir or default_store(bbox, resolution, start_date, end_date)
+    store = GridStore.create(store_dir, lats, lons, start_date, end_date)
+    with instrumentation.stage("grid_fetch") as stage:
+        fetched = 0
+        for i, j, lat_slice, lon_slice in store.chunks():
+            for year, first_day, last_day in year_ranges(start_date, end_date):
+                if not refresh and os.path.exists(store.chunk_file("hourly", year, i, j)):
+                    continue
+                store.write("hourly", year, i, j, fetch_chunk(lats[lat_slice], lons[lon_slice], first_day, last_day))
+                fetched += 1
+        stage.rows_out = fetched
+        stage.extra["points"] = lats.size * lons.size
+    print(f"Grid of {len(lats)} x {len(lons)} points fetched into {store_dir} ({fetched} new chunks)")
+    return store
+
+
+def daily_reduce(hourly, logic):
+    """
+    Daily max, min or avg of a (hours, lat, lon) chunk starting at midnight, as a (days, lat, lon) array.
+    """
+    days = hourly.reshape(-1, 24, *hourly.shape[1:])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # All-NaN days stay NaN
+        if logic == "avg":
+            return np.round(np.nanmean(days, axis=1, dtype=np.float64), 2)
+        return np.nanmin(days, axis=1) if logic == "min" else np.nanmax(days, axis=1)
+
+
+def aggregate_grid(store, logic="max", baseline=trends.BASELINE):
+    """
+    Daily and yearly statistics of every grid point, chunk by chunk.
+    Daily values are saved as `daily-<logic>-<year>-<i>-<j>.npy` chunks, and the yearly statistics of
+    `calculate_yearly_averages` (TEMPERATURE, CHANGE, ANOMALY, DAYS, COMPLETE) as one
+    (year, lat, lon) array per statistic, `yearly-<logic>-<stat>.npy`. The trend per point
+    (°C per decade with its confidence interval) goes to `trend-<logic>.npz`.
+    """
+    ranges = year_ranges(store.start_date, store.end_date)
+    years = np.array([year for year, _, _ in ranges])
+    shape = (len(years), *store.shape)
+    files = ExitStack()  # The yearly files replace the previous ones only once they are complete
+    tmp_paths = {stat: files.enter_context(csv_export.atomic_write(store.yearly_file(logic, stat)))
+                 for stat in YEARLY_STATS}
+    yearly = {stat: np.lib.format.open_memmap(tmp_paths[stat], mode="w+", dtype=np.float32, shape=shape)
+              for stat in YEARLY_STATS}
+    trend = {name: np.full(store.shape, np.nan, dtype=np.float32) for name in ("slope_per_decade", "ci_low", "ci_high")}
+
+    with files, instrumentation.stage("grid_aggregate") as stage:
+        for i, j, lat_slice, lon_slice in store.chunks():
+            daily_chunks, dates = [], []
+            for year, first_day, last_day in ranges:
+                daily = daily_reduce(np.asarray(store.read("hourly", year, i, j)), logic)
+                store.write(f"daily-{logic}", year, i, j, daily)
+                daily_chunks.append(daily)
+                dates.append(pd.date_range(first_day, last_day, freq="D"))
+
+            # One column per grid point of the chunk, reduced along the time axis
+            daily = np.concatenate(daily_chunks)
+            points = daily.shape[1:]
+            frame = pd.DataFrame(daily.reshape(len(daily), -1), index=dates[0].append(dates[1:]))
+            table = trends.yearly_table(frame)
+            mean, complete = table["mean"], table["complete"]
+            values = {
+                "TEMPERATURE": mean.round(2),
+                "CHANGE": trends.yoy_delta(mean, complete).round(2),
+                "ANOMALY": trends.anomalies(mean, complete, baseline).round(2),
+                "DAYS": table["days"],
+                "COMPLETE": complete,
+            }
+            for stat, stat_values in values.items():
+                yearly[stat][:, lat_slice, lon_slice] = stat_values.reindex(years).to_numpy(dtype=float).reshape(-1, *points)
+            chunk_trend = trends.linear_trend(mean, complete)
+            for name in trend:
+                trend[name][lat_slice, lon_slice] = chunk_trend[name].to_numpy().reshape(points)
+        stage.rows_out = int(np.prod(shape))
+        for array in yearly.values():
+            array.flush()
+        yearly.clear()  # Unmaps the files before they are renamed
+
+    with csv_export.atomic_write(os.path.join(store.path, f"trend-{logic}.npz")) as tmp_path:
+        with open(tmp_path, "wb") as file:
+            np.savez(file, lats=store.lats, lons=store.lons, years=years, **trend)
+    print(f"Grid statistics ({logic}) saved to {store.path}")
+    return years, trend
+
+
+def load_yearly(store, logic="max"):
+    """
+    Yearly statistics of the grid, {stat: (year, lat, lon) memory-mapped float32 array}.
+    DAYS is the number of days with data and COMPLETE is 1.0 or 0.0.
+    """
+    return {stat: np.load(store.yearly_file(logic, stat), mmap_mode="r") for stat in YEARLY_STATS}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch and aggregate temperatures of a latitude/longitude grid.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fetch_parser = subparsers.add_parser("fetch", help="Fetch hourly temperatures of the grid points.")
+    fetch_parser.add_argument("--bbox", type=float, nargs=4, required=True, metavar=("SOUTH", "WEST", "NORTH", "EAST"))
+    fetch_parser.add_argument("--resolution", type=float, default=0.25, help="Grid spacing in degrees.")
+    fetch_parser.add_argument("--start", type=str, default="2010-01-01", help="Start date (YYYY-MM-DD).")
+    fetch_parser.add_argument("--end", type=str, default="2024-12-05", help="End date (YYYY-MM-DD).")
+    fetch_parser.add_argument("--store", type=str, default=None, help="Store folder (default: under data/grid).")
+    fetch_parser.add_argument("--refresh", action="store_true", help="Fetch chunks already on disk again.")
+    aggregate_parser = subparsers.add_parser("aggregate", help="Daily and yearly statistics of a fetched grid.")
+    aggregate_parser.add_argument("--store", type=str, default=None,
+                                  help="Store folder (default: the most recent one under data/grid).")
+    aggregate_parser.add_argument("--logic", choices=["max", "min", "avg"], default="max", help="Daily temperature logic.")
+    args = parser.parse_args()
+
+    if args.command == "fetch":
+        fetch_grid(args.bbox, args.resolution, args.start, args.end, args.store, args.refresh)
+    else:
+        store_dir = args.store or max(glob.glob(os.path.join(config.GRID_DIR, "*", "grid.json")),
+                                      key=os.path.getmtime, default=None)
+        if store_dir is None:
+            parser.error("no grid store found, run `grid.py fetch` first")
+        grid_store = GridStore(os.path.dirname(store_dir) if store_dir.endswith("grid.json") else store_dir)
+        _, grid_trend = aggregate_grid(grid_store, args.logic)
+        print(f"Trend over the grid: {np.nanmean(grid_trend['slope_per_decade']):.2f}°C per decade on average "
+              f"(from {np.nanmin(grid_trend['slope_per_decade']):.2f} to {np.nanmax(grid_trend['slope_per_decade']):.2f})")
@@ -0,0 +1,205 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+
+import config
+import csv_export
+
+# Query parameters that do not change the response (API keys), left out of the cache key
+IGNORED_PARAMS = {"key", "appid", "apikey"}
+
+
+def normalize_request(url, params=None):
+    """
+    Build a canonical form of a GET request: lower case scheme and host,
+    query parameters from the URL and from `params` merged and sorted, API keys removed.
+    The same request written differently (param order, params in URL or dict) gives the same key.
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query += [(name, str(value)) for name, value in params.items()]
+    query = sorted((name, value) for name, value in query if name.lower() not in IGNORED_PARAMS)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+
+class HttpCache:
+    """
+    Two level cache for JSON API responses.
+    Level 1: in-memory LRU of parsed responses.
+    Level 2: on-disk store of gzip compressed responses. Bodies are stored once per content hash
+    (`blobs/<sha256>.json.gz`) and requests point to them through small ref files (`refs/<sha256>.json`).
+    Entries expire after `ttl` seconds; when the disk store is over `max_disk_bytes`
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir=config.HTTP_CACHE_DIR, ttl=config.HTTP_CACHE_TTL_SEC,
+                 max_disk_bytes=config.HTTP_CACHE_MAX_DISK_BYTES, memory_entries=config.HTTP_CACHE_MEMORY_ENTRIES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()  # key -> (created, data)
+        self.lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self.session = requests.Session()
+
+    def _ref_path(self, key_hash):
+        return os.path.join(self.cache_dir, "refs", f"{key_hash}.json")
+
+    def _blob_path(self, content_hash):
+        return os.path.join(self.cache_dir, "blobs", f"{content_hash}.json.gz")
+
+    def _remember(self, key, created, data):
+        with self.lock:
+            self.memory[key] = (created, data)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def _from_memory(self, key, ttl):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > ttl:
+                del self.memory[key]
+                return None
+            self.memory.move_to_end(key)
+            return entry[1]
+
+    def _from_disk(self, key_hash, ttl):
+        ref_path = self._ref_path(key_hash)
+        try:
+            with open(ref_path) as file:
+                ref = json.load(file)
+            if time.time() - ref["created"] > ttl:
+                return None, None
+            with gzip.open(self._blob_path(ref["content"]), "rb") as file:
+                data = json.loads(file.read())
+        except (OSError, ValueError, KeyError):
+            return None, None
+        os.utime(ref_path)  # Mark as recently used for eviction
+        return ref["created"], data
+
+    def _to_disk(self, key_hash, url, body):
+        content_hash = hashlib.sha256(body).hexdigest()
+        blob_path = self._blob_path(content_hash)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.makedirs(os.path.dirname(self._ref_path(key_hash)), exist_ok=True)
+
+        # Write to temp files and rename, so readers never see partial entries
+        if not os.path.exists(blob_path):
+            with csv_export.atomic_write(blob_path) as tmp_path:
+                with gzip.open(tmp_path, "wb") as file:
+                    file.write(body)
+
+        created = time.time()
+        ref_path = self._ref_path(key_hash)
+        with csv_export.atomic_write(ref_path) as tmp_path:
+            with open(tmp_path, "w") as file:
+                json.dump({"url": url, "content": content_hash, "created": created}, file)
+
+        self.evict()
+        return created
+
+    def evict(self):
+        """
+        Remove least recently used entries until the disk store fits in `max_disk_bytes`,
+        then delete blobs no longer referenced by any request.
+        """
+        refs_dir = os.path.join(self.cache_dir, "refs")
+        blobs_dir = os.path.join(self.cache_dir, "blobs")
+        if not os.path.isdir(refs_dir) or not os.path.isdir(blobs_dir):
+            return
+
+        blob_sizes = {}
+        for name in os.listdir(blobs_dir):
+            if name.endswith(".json.gz"):
+                blob_sizes[name[:-len(".json.gz")]] = os.path.getsize(os.path.join(blobs_dir, name))
+        if sum(blob_sizes.values()) <= self.max_disk_bytes:
+            return
+
+        refs = []
+        for name in os.listdir(refs_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(refs_dir, name)
+            try:
+                with open(path) as file:
+                    refs.append((os.path.getmtime(path), path, json.load(file)["content"]))
+            except (OSError, ValueError, KeyError):
+                continue
+        refs.sort()
+
+        # Drop oldest refs until the blobs still referenced fit the limit
+        referenced = {}
+        for _, _, content in refs:
+            referenced[content] = referenced.get(content, 0) + 1
+        total = sum(blob_sizes.get(content, 0) for content in referenced)
+        for _, path, content in refs:
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            self.stats["evictions"] += 1
+            referenced[content] -= 1
+            if referenced[content] == 0:
+                total -= blob_sizes.get(content, 0)
+
+        for content in blob_sizes:
+            if referenced.get(content, 0) == 0:
+                os.remove(self._blob_path(content))
+
+    def get_json(self, url, params=None, ttl=None, timeout=120, remember=True):
+        """
+        Return the parsed JSON response of a GET request, from memory, disk or the network.
+        Raises requests exceptions like `requests.get(...).raise_for_status()` would.
+        Only successful responses are cached. With `remember=False` the cache is bypassed:
+        for large responses that the caller stores itself (e.g. grid chunks).
+        """
+        if not remember:
+            self.stats["misses"] += 1
+            response = self.session.get(url, params=params, timeout=timeout)
+            response.raise_for_status()
+            return response.json()
+
+        ttl = self.ttl if ttl is None else ttl
+        key = normalize_request(url, params)
+        key_hash = hashlib.sha256(key.encode()).hexdigest()
+
+        data = self._from_memory(key, ttl)
+        if data is not None:
+            self.stats["memory_hits"] += 1
+            return data
+
+        created, data = self._from_disk(key_hash, ttl)
+        if data is not None:
+            self.stats["disk_hits"] += 1
+            self._remember(key, created, data)
+            return data
+
+        self.stats["misses"] += 1
+        response = self.session.get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        created = self._to_disk(key_hash, key, response.content)
+        self._remember(key, created, data)
+        return data
+
+
+# Shared cache used by all fetch functions
+cache = HttpCache()
+
+
+def get_json(url, params=None, ttl=None, remember=True):
+    """
+    GET `url` through the shared response cache and return the parsed JSON.
+    """
+    return cache.get_json(url, params=params, ttl=ttl, remember=remember)
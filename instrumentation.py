@@ -0,0 +1,228 @@
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+# Stages to profile, comma separated names or "*" for all (e.g. WEATHER_PROFILE=fetch,train)
+PROFILE_STAGES = {name.strip() for name in os.getenv("WEATHER_PROFILE", "").split(",") if name.strip()}
+# Where cProfile files (<stage>-<time>.prof) are saved
+PROFILE_DIR = os.getenv("WEATHER_PROFILE_DIR", "data/profiles")
+# JSON metrics log file; standard error when not set
+METRICS_LOG = os.getenv("WEATHER_METRICS_LOG")
+
+logger = logging.getLogger("weather.metrics")
+if not logger.handlers:
+    handler = logging.FileHandler(METRICS_LOG) if METRICS_LOG else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Totals per stage since the process started, exposed by `render_prometheus`
+metrics = {}
+metrics_lock = threading.Lock()
+# Stages running in the current thread, only the outermost one is profiled
+active = threading.local()
+# cProfile and the tracemalloc peak are process-wide, only one stage of any thread is profiled at a time
+profile_lock = threading.Lock()
+
+
+def peak_rss_bytes():
+    """
+    Peak resident memory of the process so far (0 when unknown).
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KB
+
+
+def cache_counts():
+    """
+    Hits and misses of the HTTP response cache, if it was imported by this process.
+    """
+    http_cache = sys.modules.get("http_cache")
+    if http_cache is None:
+        return 0, 0
+    stats = http_cache.cache.stats
+    return stats["memory_hits"] + stats["disk_hits"], stats["misses"]
+
+
+def profiling_enabled(name):
+    return "*" in PROFILE_STAGES or name in PROFILE_STAGES
+
+
+class StageRecord:
+    """
+    Measurements of one stage run. Set `rows_in`/`rows_out` inside the `with stage(...)` block.
+    """
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.extra = {}
+
+
+def record(entry):
+    """
+    Log one stage run as a JSON line and add it to the process totals.
+    """
+    logger.info(json.dumps(entry, default=str))
+    with metrics_lock:
+        totals = metrics.setdefault(entry["stage"], {
+            "runs": 0, "errors": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+            "rows_in": 0, "rows_out": 0, "cache_hits": 0, "cache_misses": 0,
+        })
+        totals["runs"] += 1
+        totals["errors"] += 0 if entry["ok"] else 1
+        totals["wall_seconds"] += entry["wall_seconds"]
+        totals["cpu_seconds"] += entry["cpu_seconds"]
+        totals["rows_in"] += entry["rows_in"] or 0
+        totals["rows_out"] += entry["rows_out"] or 0
+        totals["cache_hits"] += entry["cache_hits"]
+        totals["cache_misses"] += entry["cache_misses"]
+        totals["last_wall_seconds"] = entry["wall_seconds"]
+        totals["peak_rss_growth_bytes"] = entry["peak_rss_growth_bytes"]
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    Measure a pipeline stage: wall time, CPU time of its thread, growth of the peak memory,
+    rows in/out and cache hits/misses.
+
+        with instrumentation.stage("aggregate_daily", rows_in=len(data)) as st:
+            daily = calculate_daily_averages(data)
+            st.rows_out = len(daily)
+
+    When the stage is listed in WEATHER_PROFILE it also runs under cProfile and tracemalloc;
+    the profile is saved to PROFILE_DIR and the peak and top allocations of the stage are added to the log line.
+    A stage nested in another one, or running while a stage of another thread is profiled, is not profiled.
+    """
+    current = StageRecord(name, rows_in)
+    depth = getattr(active, "depth", 0)
+    active.depth = depth + 1
+    profiler = None
+    if depth == 0 and profiling_enabled(name) and profile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profiler.enable()
+
+    hits, misses = cache_counts()
+    wall_start, cpu_start, peak_start = time.perf_counter(), time.thread_time(), peak_rss_bytes()
+    ok = True
+    try:
+        yield current
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        active.depth = depth
+        wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+        new_hits, new_misses = cache_counts()
+        entry = {
+            "event": "stage",
+            "stage": name,
+            "ok": ok,
+            "time": time.time(),
+            "wall_seconds": round(wall, 6),
+            "cpu_seconds": round(cpu, 6),
+            "peak_rss_growth_bytes": peak_rss_bytes() - peak_start,
+            "rows_in": current.rows_in,
+            "rows_out": current.rows_out,
+            "cache_hits": new_hits - hits,
+            "cache_misses": new_misses - misses,
+            **current.extra,
+        }
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile_file = os.path.join(PROFILE_DIR, f"{name}-{int(time.time())}.prof")
+            profiler.dump_stats(profile_file)
+            entry["profile_file"] = profile_file
+            entry["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+            entry["top_allocations"] = [{"where": str(stat.traceback), "bytes": stat.size} for stat in top]
+            if started_tracing:
+                tracemalloc.stop()
+            profile_lock.release()
+        record(entry)
+
+
+def render_prometheus():
+    """
+    Process totals in the Prometheus text exposition format.
+    """
+    series = [
+        ("weather_stage_runs_total", "counter", "Stage runs", "runs"),
+        ("weather_stage_errors_total", "counter", "Stage runs that raised an error", "errors"),
+        ("weather_stage_wall_seconds_total", "counter", "Wall clock time spent in the stage", "wall_seconds"),
+        ("weather_stage_cpu_seconds_total", "counter", "CPU time spent in the stage", "cpu_seconds"),
+        ("weather_stage_rows_in_total", "counter", "Rows read by the stage", "rows_in"),
+        ("weather_stage_rows_out_total", "counter", "Rows produced by the stage", "rows_out"),
+        ("weather_stage_cache_hits_total", "counter", "HTTP cache hits during the stage", "cache_hits"),
+        ("weather_stage_cache_misses_total", "counter", "HTTP cache misses during the stage", "cache_misses"),
+        ("weather_stage_last_wall_seconds", "gauge", "Wall clock time of the last run", "last_wall_seconds"),
+        ("weather_stage_peak_rss_growth_bytes", "gauge", "Growth of the peak process memory during the last run",
+         "peak_rss_growth_bytes"),
+    ]
+    with metrics_lock:
+        snapshot = {name: dict(values) for name, values in metrics.items()}
+    lines = []
+    for metric, kind, help_text, key in series:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, values in sorted(snapshot.items()):
+            lines.append(f'{metric}{{stage="{name}"}} {values[key]}')
+    return "\n".join(lines) + "\n"
+
+
+def instrument_app(app):
+    """
+    Add a `/metrics` route to a Flask app and record every request as an `http:<endpoint>` stage.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = (time.perf_counter(), time.thread_time(), peak_rss_bytes())
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None and request.endpoint != "metrics":
+            record({
+                "event": "request",
+                "stage": f"http:{request.endpoint}",
+                "ok": response.status_code < 500,
+                "time": time.time(),
+                "status": response.status_code,
+                "wall_seconds": round(time.perf_counter() - start[0], 6),
+                "cpu_seconds": round(time.thread_time() - start[1], 6),
+                "peak_rss_growth_bytes": peak_rss_bytes() - start[2],
+                "rows_in": None,
+                "rows_out": None,
+                "cache_hits": 0,
+                "cache_misses": 0,
+            })
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+    return app
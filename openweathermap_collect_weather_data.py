@@ -1,64 +1,220 @@
-import requests
+import asyncio
+import calendar
 import csv
-from datetime import datetime, timedelta
+import json
 import os
+import time
+from datetime import date, datetime, timedelta, timezone
 
-# Function to collect historical weather data via API (Mode 1: Data Collection)
-def collect_historical_weather_data(api_url, api_key, year, times_of_day):
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+import csv_export
+
+# Retry settings for throttled (429) or failing (5xx) API calls
+MAX_RETRIES = 3
+RETRY_BACKOFF_SEC = 2.0
+
+
+class TokenBucket:
+    """
+    Async token bucket rate limiter.
+    Holds up to `capacity` tokens and refills at `rate` tokens per second,
+    so no `t` seconds ever allow more than `capacity + rate * t` calls.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def days_of_year(year):
+    """
+    Return every date of the year (366 days for leap years).
+    """
+    start = date(year, 1, 1)
+    return [start + timedelta(days=offset) for offset in range(366 if calendar.isleap(year) else 365)]
+
+
+def load_checkpoint(checkpoint_file):
+    """
+    Load the set of already collected dates ('YYYY-MM-DD') from the checkpoint file.
+    """
+    if not os.path.exists(checkpoint_file):
+        return set()
+    with open(checkpoint_file) as file:
+        return set(json.load(file)["done"])
+
+
+def save_checkpoint(checkpoint_file, done):
+    """
+    Save collected dates to the checkpoint file.
+    Written to a temp file and renamed, so an interruption never leaves a broken checkpoint.
+    """
+    with csv_export.atomic_write(checkpoint_file) as tmp_file:
+        with open(tmp_file, "w") as file:
+            json.dump({"done": sorted(done)}, file)
+
+
+def prepare_output(filename, done):
+    """
+    Make the CSV file match the checkpoint before appending to it.
+    Rows of days missing from the checkpoint (run interrupted between the row write
+    and the checkpoint write) are dropped, so resumed days are never duplicated.
+    """
+    rows = []
+    if done and os.path.exists(filename):
+        with open(filename, newline='') as file:
+            reader = csv.reader(file)
+            next(reader, None)  # Skip header
+            rows = [row for row in reader if row and row[0] in done]
+
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Date', 'Time', 'Temperature (°C)', 'Temperature (°F)'])
+        writer.writerows(rows)
+
+
+def fetch_day(session, api_url, api_key, current_date):
+    """
+    Request hourly data of one day from OpenWeatherMap (blocking, runs in a worker thread).
+    """
     headers = {'Content-Type': 'application/json'}
-    
-    # Prepare the start and end dates for the year
-    start_date = f'{year}-01-01'
-    end_date = f'{year}-12-31'
-
-    # Create a list to hold all the temperature data
-    all_data = []
-
-    # Loop over each day in the year and get hourly weather data
-    for day_offset in range(365):  # Loop through days of the year (adjust if it's a leap year)
-        # Calculate the date for the current day
-        current_date = (datetime.strptime(start_date, '%Y-%m-%d') + timedelta(days=day_offset)).strftime('%Y-%m-%d')
-        
-        # Convert date to Unix timestamp for the API request
-        timestamp = int(datetime.strptime(current_date, '%Y-%m-%d').timestamp())
-        
-        # Request hourly data from OpenWeatherMap
-        params = {'lat': 40.730610, 'lon': -73.935242, 'dt': timestamp, 'appid': api_key, 'units': 'metric'}
-        response = requests.get(f'https://api.openweathermap.org/data/2.5/onecall/timemachine', params=params, headers=headers)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Check the hourly data for the required times
-            for hourly_data in data['hourly']:
-                # Extract the hour from the time
-                hour = datetime.utcfromtimestamp(hourly_data['dt']).strftime('%H:%M')
-                
-                # If the hour matches one of the desired times, store the data
-                if hour in times_of_day:
-                    date_time = datetime.utcfromtimestamp(hourly_data['dt']).strftime('%Y-%m-%d %H:%M:%S')
-                    temp_celsius = hourly_data['temp']
-                    temp_fahrenheit = (temp_celsius * 9/5) + 32  # Convert Celsius to Fahrenheit
-                    
-                    all_data.append([current_date, date_time, temp_celsius, temp_fahrenheit])
-        else:
+    # Convert date to Unix timestamp (UTC midnight) for the API request
+    timestamp = calendar.timegm(current_date.timetuple())
+    params = {'lat': 40.730610, 'lon': -73.935242, 'dt': timestamp, 'appid': api_key, 'units': 'metric'}
+    return session.get(api_url, params=params, headers=headers, timeout=30)
+
+
+def parse_day(data, current_date, times_of_day):
+    """
+    Extract the rows for the required times of day from an API response.
+    """
+    rows = []
+    for hourly_data in data['hourly']:
+        # Extract the hour from the time
+        moment = datetime.fromtimestamp(hourly_data['dt'], tz=timezone.utc)
+
+        # If the hour matches one of the desired times, store the data
+        if moment.strftime('%H:%M') in times_of_day:
+            temp_celsius = hourly_data['temp']
+            temp_fahrenheit = (temp_celsius * 9/5) + 32  # Convert Celsius to Fahrenheit
+            rows.append([current_date.isoformat(), moment.strftime('%Y-%m-%d %H:%M:%S'), temp_celsius, temp_fahrenheit])
+    return rows
+
+
+async def collect_day(session, bucket, in_flight, api_url, api_key, current_date, times_of_day):
+    """
+    Fetch one day respecting the rate limit and the in-flight limit.
+    Retries throttled and server errors with exponential backoff.
+    Returns the date and its rows (None if the day could not be collected).
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        await bucket.acquire()
+        async with in_flight:
+            try:
+                response = await asyncio.to_thread(fetch_day, session, api_url, api_key, current_date)
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching data for {current_date}: {e}")
+                response = None
+
+        if response is not None and response.status_code == 200:
+            return current_date, parse_day(response.json(), current_date, times_of_day)
+        if response is not None and response.status_code not in (429, 500, 502, 503, 504):
             print(f"Error fetching data for {current_date}: {response.status_code}")
-    
-    # Write the collected data to a CSV file
+            return current_date, None
+        if attempt < MAX_RETRIES:
+            await asyncio.sleep(RETRY_BACKOFF_SEC * 2 ** attempt)
+
+    print(f"Giving up on {current_date} after {MAX_RETRIES} retries")
+    return current_date, None
+
+
+async def collect_historical_weather_data_async(api_url, api_key, year, times_of_day,
+                                                calls_per_minute=config.OPENWEATHERMAP_CALLS_PER_MINUTE,
+                                                max_in_flight=config.OPENWEATHERMAP_MAX_IN_FLIGHT):
+    """
+    Collect historical weather data for the whole year via API (Mode 1: Data Collection).
+    Rows are appended to `<year>-temp.csv` as soon as a day arrives and progress is
+    checkpointed in `<year>-temp.checkpoint.json`, so an interrupted run resumes where it stopped.
+    Rows are in arrival order, not date order.
+    """
     filename = f"{year}-temp.csv"
-    with open(filename, 'w', newline='') as csvfile:
+    checkpoint_file = f"{year}-temp.checkpoint.json"
+
+    done = load_checkpoint(checkpoint_file)
+    prepare_output(filename, done)
+    pending = [day for day in days_of_year(year) if day.isoformat() not in done]
+    if not pending:
+        print(f"Data for {year} already collected in {filename}")
+        return
+    print(f"Collecting {len(pending)} days of {year} ({len(done)} already done)...")
+
+    # Bursts of at most `max_in_flight` calls and the refill makes up the rest of the quota,
+    # so no minute ever holds more than `calls_per_minute` calls
+    burst = max(1, min(max_in_flight, calls_per_minute // 2))
+    bucket = TokenBucket(rate=max(calls_per_minute - burst, 1) / 60, capacity=burst)
+    in_flight = asyncio.Semaphore(max_in_flight)
+
+    # One session for all requests, so HTTPS connections are reused
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_maxsize=max_in_flight))
+
+    failed = 0
+    with session, open(filename, 'a', newline='') as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(['Date', 'Time', 'Temperature (°C)', 'Temperature (°F)'])
-        for row in all_data:
-            writer.writerow(row)
-    
+        tasks = [
+            asyncio.create_task(collect_day(session, bucket, in_flight, api_url, api_key, day, times_of_day))
+            for day in pending
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                current_date, rows = await task
+                if rows is None:
+                    failed += 1
+                    continue
+                writer.writerows(rows)
+                csvfile.flush()
+                done.add(current_date.isoformat())
+                save_checkpoint(checkpoint_file, done)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    if failed:
+        print(f"{failed} days of {year} failed, run again to retry them")
     print(f"Data for {year} collected and stored in {filename}")
 
+
+def collect_historical_weather_data(api_url, api_key, year, times_of_day):
+    """
+    Blocking wrapper around `collect_historical_weather_data_async`.
+    """
+    asyncio.run(collect_historical_weather_data_async(api_url, api_key, year, times_of_day))
+
+
 # Example of running Mode 1: Collect historical data for 2021 with times 04:00, 10:00, 16:00, and 22:00
-# api_url = 'https://api.openweathermap.org/data/2.5/onecall/timemachine'
-# api_key = 'XXX'  # Your OpenWeatherMap API key
-# use config.py for api key and url
+# api_url and api_key come from config.py (key from OPENWEATHERMAP_API_KEY env var)
 year = 2021
 times_of_day = ['04:00', '10:00', '16:00', '22:00']
 
-collect_historical_weather_data(api_url, api_key, year, times_of_day)
+if __name__ == "__main__":
+    if not config.OPENWEATHERMAP_API_KEY:
+        print("Error: set the OPENWEATHERMAP_API_KEY environment variable")
+    else:
+        collect_historical_weather_data(config.OPENWEATHERMAP_API_URL, config.OPENWEATHERMAP_API_KEY, year, times_of_day)
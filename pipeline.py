@@ -0,0 +1,298 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date
+
+import csv_export
+import instrumentation
+from scripts import ROOT, load_script
+
+# Hashes of the last successful run of every stage
+STATE_FILE = "data/.pipeline-state.json"
+
+# Folder of the range ending today (`--end today`), data/<start>-latest, replaced on every run
+LATEST_DIR = "data/{start}-latest"
+
+# Jersey City, same as `Climate Change Main.py`
+LATITUDE, LONGITUDE = 40.7282, -74.0776
+
+
+def file_hash(path, known):
+    """
+    SHA-256 of a file's content. Hashes are remembered by (size, mtime) in `known`,
+    so unchanged files are not read again on the next run.
+    """
+    stat = os.stat(path)
+    signature = f"{stat.st_size}:{stat.st_mtime_ns}"
+    entry = known.get(path)
+    if entry and entry["signature"] == signature:
+        return entry["sha256"]
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    known[path] = {"signature": signature, "sha256": digest.hexdigest()}
+    return known[path]["sha256"]
+
+
+class Stage:
+    """
+    One step of the pipeline.
+    `inputs` and `outputs` are file paths (callables, since some paths are only known after
+    earlier stages ran); `code` lists the scripts whose changes must invalidate the outputs.
+    """
+
+    def __init__(self, name, deps, run, inputs=(), outputs=(), params=None, code=()):
+        self.name = name
+        self.deps = deps
+        self.run = run
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+        self.code = code
+
+    def paths(self, attribute):
+        value = getattr(self, attribute)
+        return sorted(value() if callable(value) else value)
+
+    def fingerprint(self, known_files):
+        """
+        Hash of everything the stage output depends on: parameters, input files and code.
+        """
+        digest = hashlib.sha256(json.dumps({"stage": self.name, "params": self.params}, sort_keys=True).encode())
+        for path in self.paths("inputs") + [os.path.join(ROOT, name) for name in self.code]:
+            digest.update(path.encode())
+            digest.update(file_hash(path, known_files).encode() if os.path.exists(path) else b"missing")
+        return digest.hexdigest()
+
+
+def build_stages(logic, start_date, end_date, forecaster, days, refresh=False, data_dir=None):
+    """
+    The fetch -> aggregate -> summarize -> train -> forecast -> render graph for one date range.
+    With `refresh` the fetch stage asks the API again instead of reusing the hourly cache file.
+    The files go to `data_dir`, data/<start>-<end> by default; a range whose end moves
+    (see LATEST_DIR) keeps one folder and its end date is only a parameter of the stages.
+    """
+    data_dir = data_dir or f"data/{start_date.replace('-', '')}-{end_date.replace('-', '')}"
+    hourly_file = f"{data_dir}/openmeteo-{os.path.basename(data_dir)}.csv"
+    daily_file = f"{data_dir}/daily-{logic}.csv"
+    yearly_file = f"{data_dir}/yearly-{logic}.csv"
+    # The ensemble fits its members itself and only uses a SARIMA model trained by `--forecaster sarima`
+    model_file = f"{data_dir}/daily-{logic}_{'rf' if forecaster == 'random-forest' else 'sarima'}.pkl"
+    forecast_file = "data/forecast_output.csv"
+    plot_file = f"static/yearly-{logic}-plot.png"
+
+    def climate_main():
+        main = load_script("Climate Change Main.py", "climate_main")
+        main.data_dir, main.calc_logic = data_dir, logic
+        return main
+
+    def fetch():
+        os.makedirs(data_dir, exist_ok=True)
+        if climate_main().fetch_openmeteo_weather_data(LATITUDE, LONGITUDE, start_date, end_date,
+                                                       enforce_api_call=refresh, cache_file=hourly_file) is None:
+            raise RuntimeError("No valid temperature data fetched")
+
+    def aggregate():
+        climate_main().main(logic, start_date, end_date, data_dir, hourly_file)
+
+    def summarize():
+        import rollups
+        rollups.build_rollups([hourly_file])
+
+    def train():
+        import joblib
+        if forecaster == "sarima":
+            sarima = load_script("forecast-sarima.py", "forecast_sarima")
+            if os.path.exists(model_file):
+                os.remove(model_file)  # train_model() would load the outdated model
+            if sarima.train_model(sarima.load_and_parse_csv(daily_file)["T"], model_file) is None:
+                raise RuntimeError("SARIMA training failed")
+        else:
+            random_forest = load_script("forecast-random-forest.py", "forecast_random_forest")
+            series = random_forest.daily_history(random_forest.load_and_parse_csv(daily_file))
+            X, complete = random_forest.lagged_features(series.to_numpy(), series.index)
+            joblib.dump(random_forest.train_model(X[complete], series.to_numpy()[complete]), model_file)
+
+    def forecast():
+        if forecaster == "ensemble":
+            import ensemble
+            forecast_df, report = ensemble.ensemble_forecast(daily_file, days)
+            if forecast_df is None:
+                raise RuntimeError("No ensemble member could forecast")
+            ensemble.write_forecast(forecast_df, report, forecast_file)
+            return
+        import joblib
+        import pandas as pd
+        model = joblib.load(model_file)
+        if forecaster == "sarima":
+            sarima = load_script("forecast-sarima.py", "forecast_sarima")
+            daily = sarima.load_and_parse_csv(daily_file)
+            forecast_df = sarima.sarima_forecast(model, daily.index.max() + pd.Timedelta(days=1), days)
+        else:
+            random_forest = load_script("forecast-random-forest.py", "forecast_random_forest")
+            series = random_forest.daily_history(random_forest.load_and_parse_csv(daily_file))
+            forecast_df = random_forest.forecast_next_days(model, series, days)
+        forecast_df.to_csv(forecast_file, index=False)
+
+    def render():
+        plots = load_script("flask-webserver.py", "plot_webserver")
+        plots.generate_plot(data_dir, force=True)
+
+    params = {"logic": logic, "start": start_date, "end": end_date, "dir": data_dir}
+    model_params = {**params, "forecaster": forecaster}
+    stages = [
+        Stage("fetch", [], fetch, outputs=[hourly_file], params=params),
+        Stage("aggregate", ["fetch"], aggregate, inputs=[hourly_file], outputs=[daily_file, yearly_file],
+              params=params, code=["Climate Change Main.py", "trends.py", "daily_series.py", "quality.py"]),
+        Stage("summarize", ["fetch"], summarize, inputs=[hourly_file],
+              outputs=lambda: glob.glob("data/rollups/*/*.csv") or ["data/rollups/year/all.csv"],
+              params=params, code=["rollups.py"]),
+    ]
+    if forecaster == "ensemble":
+        stages.append(Stage("forecast", ["aggregate"], forecast, inputs=[daily_file, model_file], outputs=[forecast_file],
+                            params={**model_params, "days": days},
+                            code=["ensemble.py", "forecast.py", "forecast-sarima.py", "forecast-random-forest.py"]))
+    else:
+        stages += [
+            Stage("train", ["aggregate"], train, inputs=[daily_file], outputs=[model_file], params=model_params,
+                  code=["forecast-sarima.py" if forecaster == "sarima" else "forecast-random-forest.py"]),
+            Stage("forecast", ["train"], forecast, inputs=[daily_file, model_file], outputs=[forecast_file],
+                  params={**model_params, "days": days},
+                  code=["forecast-sarima.py" if forecaster == "sarima" else "forecast-random-forest.py"]),
+        ]
+    stages += [
+        Stage("render", ["aggregate"], render, inputs=lambda: glob.glob(f"{data_dir}/yearly-*.csv"),
+              outputs=[plot_file], params=params, code=["flask-webserver.py", "rolling.py"]),
+    ]
+    return {stage.name: stage for stage in stages}
+
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {"stages": {}, "files": {}}
+    with open(STATE_FILE) as file:
+        return json.load(file)
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    with csv_export.atomic_write(STATE_FILE) as tmp_file:
+        with open(tmp_file, "w") as file:
+            json.dump(state, file, indent=1, sort_keys=True)
+
+
+def required_stages(stages, targets):
+    """
+    The targets and every stage they depend on.
+    """
+    needed, pending = set(), list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(stages[name].deps)
+    return needed
+
+
+def is_current(stage, state, key):
+    """
+    A stage is current when its outputs exist and its fingerprint did not change since its last run.
+    """
+    outputs = stage.paths("outputs")
+    if not outputs or not all(os.path.exists(path) for path in outputs):
+        return False
+    return state["stages"].get(key) == stage.fingerprint(state["files"])
+
+
+def run(stages, targets, jobs=4, force=(), dry_run=False):
+    """
+    Run the stages needed for `targets`, in dependency order and independent stages in parallel.
+    Stages whose outputs are current are skipped. Returns {stage: "ran" | "skipped" | "failed" | ...}.
+    """
+    state = load_state()
+    state_lock = threading.Lock()
+    needed = required_stages(stages, targets)
+    scope = next(iter(stages.values())).params
+    status = {}
+
+    def key(stage):
+        # The folder identifies the date range, so a range ending today keeps the same keys every day
+        scope = {name: value for name, value in stage.params.items() if name not in ("start", "end")}
+        return f"{stage.name}:{json.dumps(scope, sort_keys=True)}"
+
+    def execute(stage):
+        # Up-to-date check happens when dependencies are done, so their new outputs are hashed
+        with state_lock:
+            current = stage.name not in force and is_current(stage, state, key(stage))
+        if current:
+            return "skipped"
+        if dry_run:
+            return "would run"
+        print(f"[{stage.name}] running...")
+        with instrumentation.stage(f"pipeline_{stage.name}"):
+            stage.run()
+        with state_lock:
+            state["stages"][key(stage)] = stage.fingerprint(state["files"])
+            save_state(state)
+        return "ran"
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+        while len(status) < len(needed):
+            for name in sorted(needed - set(status) - {stage.name for stage in running.values()}):
+                deps = stages[name].deps
+                if any(status.get(dep) in ("failed", "blocked") for dep in deps):
+                    status[name] = "blocked"
+                elif all(status.get(dep) in ("ran", "skipped", "would run") for dep in deps):
+                    running[pool.submit(execute, stages[name])] = stages[name]
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    status[stage.name] = future.result()
+                except Exception as e:
+                    print(f"[{stage.name}] failed: {e}")
+                    status[stage.name] = "failed"
+                print(f"[{stage.name}] {status[stage.name]}")
+
+    print(f"Pipeline {scope}: " + ", ".join(f"{name} {status[name]}" for name in stages if name in status))
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the weather pipeline (fetch -> aggregate -> summarize -> train -> forecast -> render), "
+                    "skipping stages whose outputs are up to date.")
+    parser.add_argument("targets", nargs="*", default=["forecast", "render", "summarize"],
+                        help="Stages to bring up to date with their dependencies (default: all).")
+    parser.add_argument("--logic", choices=["max", "min", "avg"], default="max", help="Daily temperature logic.")
+    parser.add_argument("--start", type=str, default="2010-01-01", help="Start date (YYYY-MM-DD).")
+    parser.add_argument("--end", type=str, default="2024-12-05", help="End date (YYYY-MM-DD or \"today\").")
+    parser.add_argument("--forecaster", choices=["random-forest", "sarima", "ensemble"], default="random-forest",
+                        help="Model used by the train and forecast stages (the ensemble has no train stage).")
+    parser.add_argument("--days", type=int, default=10, help="Number of days to forecast.")
+    parser.add_argument("--jobs", type=int, default=4, help="Stages run in parallel.")
+    parser.add_argument("--force", nargs="*", default=[], help="Stages to run even if up to date.")
+    parser.add_argument("--dry-run", action="store_true", help="Only show which stages would run.")
+    args = parser.parse_args()
+
+    if args.end == "today":
+        end, folder = date.today().isoformat(), LATEST_DIR.format(start=args.start.replace('-', ''))
+    else:
+        end, folder = args.end, None
+    # The hourly file of the latest folder is from an earlier day or run, so it is always fetched again
+    pipeline = build_stages(args.logic, args.start, end, args.forecaster, args.days,
+                            refresh="fetch" in args.force or folder is not None, data_dir=folder)
+    unknown = set(args.targets + args.force) - set(pipeline)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    result = run(pipeline, args.targets, args.jobs, set(args.force), args.dry_run)
+    if "failed" in result.values():
+        raise SystemExit(1)
@@ -0,0 +1,165 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import config
+
+# Quality flags of an hour, combined bitwise in the `quality` column of the hourly cache files
+MISSING = 1         # No value from the source (hour added to complete the hourly series)
+DUPLICATE = 2       # Several values for this hour, merged into their mean
+OUTLIER = 4         # Outside QUALITY_LIMITS or a spike, the value was removed
+TIMEZONE = 8        # Timestamp not on the hour, or on a day shifted by DST (01:00 twice or no 02:00)
+FILLED = 16         # Value filled by the fill strategy
+INCOMPLETE_DAY = 32  # Day with fewer than QUALITY_MIN_HOURS_PER_DAY hours, left out of the daily values
+
+FLAGS = {"missing": MISSING, "duplicate": DUPLICATE, "outlier": OUTLIER, "timezone": TIMEZONE,
+         "filled": FILLED, "incomplete_day": INCOMPLETE_DAY}
+FILL_STRATEGIES = ("interpolate", "ffill", "climatology", "none")
+
+
+def gap_lengths(missing):
+    """
+    Length of the run of missing values each value belongs to (0 for values that are not missing).
+    """
+    starts = missing & ~np.r_[False, missing[:-1]]
+    run = np.cumsum(starts) * missing
+    return np.bincount(run)[run] * missing
+
+
+def fill(values, strategy=config.QUALITY_FILL, max_gap=config.QUALITY_MAX_GAP_HOURS, climatology=None):
+    """
+    Fill the runs of NaN of at most `max_gap` values of a regular series.
+    Strategies: "interpolate" (linear, gaps at the ends are not filled), "ffill" (last value),
+    "climatology" (the `climatology` value of the same position) or "none".
+    Returns the filled values and the mask of the values filled.
+    """
+    if strategy not in FILL_STRATEGIES:
+        raise ValueError(f"Unknown fill strategy '{strategy}', expected one of {', '.join(FILL_STRATEGIES)}")
+    values = np.array(values, dtype=float)
+    missing = np.isnan(values)
+    fillable = missing & (gap_lengths(missing) <= max_gap)
+    valid = np.flatnonzero(~missing)
+    if strategy == "none" or len(valid) == 0:
+        return values, np.zeros(len(values), dtype=bool)
+
+    positions = np.arange(len(values))
+    if strategy == "interpolate":
+        fillable &= (positions > valid[0]) & (positions < valid[-1])
+        values[fillable] = np.interp(positions[fillable], valid, values[valid])
+    elif strategy == "ffill":
+        previous = np.maximum.accumulate(np.where(missing, -1, positions))
+        fillable &= previous >= 0
+        values[fillable] = values[previous[fillable]]
+    else:
+        fillable &= ~np.isnan(climatology)
+        values[fillable] = climatology[fillable]
+    return values, fillable
+
+
+def spikes(values, z=config.QUALITY_SPIKE_Z):
+    """
+    Values far from the centered 25-hour median, in robust standard deviations
+    (1.4826 x median absolute deviation of the whole series).
+    """
+    series = pd.Series(values)
+    residual = (series - series.rolling(25, center=True, min_periods=5).median()).to_numpy()
+    scale = 1.4826 * np.nanmedian(np.abs(residual)) if np.any(~np.isnan(residual)) else np.nan
+    with np.errstate(invalid="ignore"):
+        return np.abs(residual) > z * scale if scale > 0 else np.zeros(len(values), dtype=bool)
+
+
+def check_hourly(hourly, strategy=config.QUALITY_FILL):
+    """
+    Data quality stage of hourly temperatures (DataFrame with `time` and `temperature`), run once at ingest.
+    Detects duplicates, DST/timezone anomalies, missing hours and days, and outliers with array operations,
+    fills the short gaps with `strategy` and flags every hour.
+    Returns (clean, report): `clean` has one row per hour of every day from the first to the last
+    (`time`, `temperature`, `quality` flags), `report` counts each issue.
+    """
+    times = pd.to_datetime(hourly["time"])
+    temperatures = pd.to_numeric(hourly["temperature"], errors="coerce")
+    if times.empty:
+        return pd.DataFrame({"time": [], "temperature": [], "quality": []}), {"hours": 0}
+    hours = times.dt.floor("h")
+    off_hour = times != hours
+
+    # Complete hourly series from the first day 00:00 to the last day 23:00
+    index = pd.date_range(hours.min().normalize(), hours.max().normalize() + pd.Timedelta(hours=23), freq="h")
+    days = (index.normalize() - index[0]).days.to_numpy()
+    grouped = temperatures.groupby(hours.to_numpy())
+    values = grouped.mean().reindex(index).to_numpy(dtype=float, copy=True)
+    readings = grouped.size().reindex(index, fill_value=0).to_numpy()
+
+    # Local time DST shifts: a day of 25 readings with 01:00 twice, or of 23 readings without 02:00
+    per_day = readings.reshape(-1, 24)
+    total = per_day.sum(axis=1)
+    dst = ((total == 25) & (per_day[:, 1] == 2)) | ((total == 23) & (per_day[:, 2] == 0))
+
+    quality = np.zeros(len(index), dtype=np.uint8)
+    quality[readings > 1] |= DUPLICATE
+    quality[index.isin(hours[off_hour]) | dst[days]] |= TIMEZONE
+    quality[np.isnan(values)] |= MISSING
+
+    low, high = config.QUALITY_LIMITS
+    with np.errstate(invalid="ignore"):
+        outliers = (values < low) | (values > high)
+    outliers |= spikes(np.where(outliers, np.nan, values))
+    quality[outliers] |= OUTLIER
+    values[outliers] = np.nan
+
+    climatology = None
+    if strategy == "climatology":
+        frame = pd.DataFrame({"value": values, "month": index.month, "hour": index.hour})
+        climatology = frame.groupby(["month", "hour"])["value"].transform("mean").to_numpy()
+    values, filled = fill(values, strategy, config.QUALITY_MAX_GAP_HOURS, climatology)
+    quality[filled] |= FILLED
+
+    hours_per_day = np.bincount(days, weights=~np.isnan(values))
+    quality[hours_per_day[days] < config.QUALITY_MIN_HOURS_PER_DAY] |= INCOMPLETE_DAY
+
+    clean = pd.DataFrame({
+        "time": np.datetime_as_string(index.to_numpy().astype("datetime64[m]")),
+        "temperature": values,
+        "quality": quality,
+    })
+    report = {
+        "hours": len(index),
+        "days": int(len(hours_per_day)),
+        "readings": len(hourly),
+        "invalid_values": int((temperatures.isna() & hourly["temperature"].notna()).sum()),
+        "missing_days": int((np.bincount(days, weights=(quality & MISSING) == 0) == 0).sum()),
+        "dst_days": [day.strftime("%Y-%m-%d") for day in index[::24][dst]],
+        "strategy": strategy,
+        **{name: int(np.count_nonzero(quality & flag)) for name, flag in FLAGS.items()},
+    }
+    return clean, report
+
+
+def usable(clean):
+    """
+    Temperatures to aggregate: NaN for the hours of incomplete days.
+    """
+    return np.where(clean["quality"].to_numpy() & INCOMPLETE_DAY, np.nan, clean["temperature"].to_numpy(dtype=float))
+
+
+def load_hourly(path):
+    """
+    Read an hourly cache file with its usable temperatures (NaN for the hours of incomplete days).
+    Files written before the quality stage existed are checked in memory; the file is never rewritten.
+    Returns a DataFrame with `time`, `temperature` and `quality`.
+    """
+    clean = pd.read_csv(path, dtype={"time": str})
+    if "quality" not in clean.columns:
+        clean, _ = check_hourly(clean)
+    return clean.assign(temperature=usable(clean))
+
+
+def summary(report):
+    counts = ", ".join(f"{report[name]} {name.replace('_', ' ')}" for name in FLAGS if report.get(name))
+    return f"Data quality: {report['hours']} hours, {counts or 'no issues'}"
+
+
+def write_report(report, path):
+    with open(path, "w") as file:
+        json.dump(report, file, indent=1)
@@ -0,0 +1,186 @@
+from collections import deque
+import math
+
+import numpy as np
+
+# Statistics supported by the rolling engine
+STATS = ("mean", "min", "max", "std")
+
+
+def _windowed_extreme(values, window, func):
+    """
+    Sliding min/max with the van Herk/Gil-Werman algorithm: O(1) work per element
+    whatever the window size. `func` is np.minimum or np.maximum.
+    Returns one value per full window (len(values) - window + 1 values).
+    """
+    n = len(values)
+    fill = np.inf if func is np.minimum else -np.inf
+    blocks = -(-n // window)
+    padded = np.full(blocks * window, fill)
+    padded[:n] = values
+    padded = padded.reshape(blocks, window)
+    # Running extreme from the start of each block, and from the end of each block
+    prefix = func.accumulate(padded, axis=1).ravel()
+    suffix = func.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+    # Window [i, i + window - 1] spans at most two blocks
+    return func(suffix[:n - window + 1], prefix[window - 1:n])
+
+
+def rolling_stats(values, windows, stats=("mean",)):
+    """
+    Compute rolling statistics for several windows in one pass over the series.
+    Returns a dict {(stat, window): numpy array} aligned with `values`, like
+    pandas `Series.rolling(window).<stat>()`: the first `window - 1` values are NaN,
+    and so is any window containing a NaN. `std` is the sample standard deviation.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    valid = ~np.isnan(values)
+    has_nan = not valid.all()
+
+    # Prefix sums are shared by all windows. Values are shifted by their mean to keep `std` accurate.
+    shift = values[valid].mean() if valid.any() else 0.0
+    centered = np.where(valid, values - shift, 0.0)
+    csum = np.concatenate(([0.0], np.cumsum(centered)))
+    csum_sq = np.concatenate(([0.0], np.cumsum(centered * centered))) if "std" in stats else None
+    cnan = np.concatenate(([0], np.cumsum(~valid))) if has_nan else None
+
+    result = {}
+    for window in windows:
+        for stat in stats:
+            if stat not in STATS:
+                raise ValueError(f"Unknown rolling statistic '{stat}', expected one of {STATS}")
+            out = np.full(n, np.nan)
+            if window > n:
+                result[(stat, window)] = out
+                continue
+
+            if stat == "mean":
+                full = (csum[window:] - csum[:-window]) / window + shift
+            elif stat == "std":
+                sums = csum[window:] - csum[:-window]
+                squares = csum_sq[window:] - csum_sq[:-window]
+                variance = (squares - sums * sums / window) / (window - 1) if window > 1 else np.full(n - window + 1, np.nan)
+                full = np.sqrt(np.maximum(variance, 0.0))
+            else:
+                func = np.minimum if stat == "min" else np.maximum
+                full = _windowed_extreme(np.where(valid, values, np.nan), window, func)
+
+            if has_nan:
+                full = np.where(cnan[window:] - cnan[:-window] > 0, np.nan, full)
+            out[window - 1:] = full
+            result[(stat, window)] = out
+    return result
+
+
+def rolling_mean(values, window):
+    """
+    Rolling mean of `values` over `window` elements (NaN until the window is full).
+    """
+    return rolling_stats(values, (window,), ("mean",))[("mean", window)]
+
+
+
+class RollingWindow:
+    """
+    Append-only rolling window over the last `size` values of a stream.
+    Each `append` updates mean, min, max and std in O(1) amortized time,
+    using running sums and monotonic queues instead of rescanning the window.
+    Like `rolling_stats`, the statistics are NaN while the window is not full
+    or contains a NaN; NaN values are counted, not added to the sums.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = deque()  # Centered values, 0 for NaN
+        self.nans = deque()  # True for the NaN values of the window
+        self.nan_count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.shift = None
+        self.count = 0  # Number of values appended so far
+        self.min_queue = deque()  # (index, value), increasing values
+        self.max_queue = deque()  # (index, value), decreasing values
+
+    def append(self, value):
+        value = float(value)
+        missing = math.isnan(value)
+        if self.shift is None and not missing:
+            self.shift = value
+        centered = 0.0 if missing else value - self.shift
+        self.values.append(centered)
+        self.nans.append(missing)
+        self.nan_count += missing
+        self.total += centered
+        self.total_sq += centered * centered
+        if len(self.values) > self.size:
+            old = self.values.popleft()
+            self.nan_count -= self.nans.popleft()
+            self.total -= old
+            self.total_sq -= old * old
+
+        index = self.count
+        self.count += 1
+        if not missing:
+            while self.min_queue and self.min_queue[-1][1] >= value:
+                self.min_queue.pop()
+            self.min_queue.append((index, value))
+            while self.max_queue and self.max_queue[-1][1] <= value:
+                self.max_queue.pop()
+            self.max_queue.append((index, value))
+        # Drop values that left the window
+        while self.min_queue and self.min_queue[0][0] <= index - self.size:
+            self.min_queue.popleft()
+        while self.max_queue and self.max_queue[0][0] <= index - self.size:
+            self.max_queue.popleft()
+
+    @property
+    def valid(self):
+        return len(self.values) == self.size and self.nan_count == 0
+
+    @property
+    def mean(self):
+        return self.total / self.size + self.shift if self.valid else math.nan
+
+    @property
+    def min(self):
+        return self.min_queue[0][1] if self.valid else math.nan
+
+    @property
+    def max(self):
+        return self.max_queue[0][1] if self.valid else math.nan
+
+    @property
+    def std(self):
+        if not self.valid or self.size < 2:
+            return math.nan
+        variance = (self.total_sq - self.total * self.total / self.size) / (self.size - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    def stats(self):
+        return {stat: getattr(self, stat) for stat in STATS}
+
+
+class IncrementalRolling:
+    """
+    Rolling statistics for a series that grows by chunks (new days, new years).
+    Only the tail needed by the largest window is kept, so `extend` computes
+    the statistics of the new values without recomputing the whole series;
+    they are the same as `rolling_stats` of the whole series.
+    """
+
+    def __init__(self, windows, stats=("mean",)):
+        self.windows = tuple(windows)
+        self.stats = tuple(stats)
+        self.tail = np.empty(0)
+
+    def extend(self, values):
+        """
+        Append `values` and return {(stat, window): array} for the new values only.
+        """
+        values = np.asarray(values, dtype=float)
+        series = np.concatenate((self.tail, values))
+        result = rolling_stats(series, self.windows, self.stats)
+        keep = max(self.windows) - 1
+        self.tail = series[max(0, len(series) - keep):] if keep else np.empty(0)
+        return {key: column[len(series) - len(values):] for key, column in result.items()}
@@ -0,0 +1,296 @@
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+import csv_export
+import quality
+
+# Folder with the pre-aggregated tables of every resolution: <level>/<year>.csv for the levels
+# with many buckets (one file per year), <level>/all.csv for the others
+ROLLUP_DIR = "data/rollups"
+
+# Resolutions of the pyramid and the level each one is built from
+LEVELS = ("day", "week", "month", "season", "year", "decade")
+PARENT = {"week": "day", "month": "day", "season": "day", "year": "day", "decade": "year"}
+PARTITIONED = {"day": True, "week": True, "month": False, "season": False, "year": False, "decade": False}
+# Length of the buckets of every level
+BUCKET_LENGTH = {"day": pd.DateOffset(days=1), "week": pd.DateOffset(weeks=1), "month": pd.DateOffset(months=1),
+                 "season": pd.DateOffset(months=3), "year": pd.DateOffset(years=1), "decade": pd.DateOffset(years=10)}
+
+# Aggregates kept for every bucket. They can be merged (summed, min-ed, max-ed), so a
+# bucket of any level is built from the buckets of the level below without the hourly data.
+SUM_COLUMNS = ["hours", "temp_sum", "days", "dmax_sum", "dmin_sum", "davg_sum"]
+COLUMNS = ["bucket", "hours", "temp_sum", "temp_min", "temp_max", "days", "dmax_sum", "dmin_sum", "davg_sum"]
+
+
+def bucket_start(dates, level):
+    """
+    Return the first day of the `level` bucket containing each date.
+    Weeks start on Monday, seasons are meteorological (Dec-Feb is the winter of the next year).
+    """
+    dates = pd.DatetimeIndex(dates).normalize()
+    if level == "day":
+        return dates
+    if level == "week":
+        return dates - pd.to_timedelta(dates.dayofweek, unit="D")
+
+    year, month = dates.year.to_numpy(), dates.month.to_numpy()
+    if level == "month":
+        start_year, start_month = year, month
+    elif level == "season":
+        start_month = (month // 3) * 3
+        start_year = np.where(start_month == 0, year - 1, year)
+        start_month = np.where(start_month == 0, 12, start_month)
+    elif level == "year":
+        start_year, start_month = year, np.ones_like(month)
+    elif level == "decade":
+        start_year, start_month = (year // 10) * 10, np.ones_like(month)
+    else:
+        raise ValueError(f"Unknown rollup level '{level}', expected one of {LEVELS}")
+    months = (np.asarray(start_year, dtype=np.int64) - 1970) * 12 + np.asarray(start_month, dtype=np.int64) - 1
+    return pd.DatetimeIndex(months.astype("datetime64[M]").astype("datetime64[ns]"))
+
+
+def bucket_days(buckets, level):
+    """
+    Number of calendar days of the `level` buckets starting on `buckets`.
+    """
+    buckets = pd.DatetimeIndex(buckets)
+    return ((buckets + BUCKET_LENGTH[level]) - buckets).days.to_numpy()
+
+
+def aggregate_hours(hourly):
+    """
+    Build the day level from hourly data (DataFrame with `time` and `temperature`).
+    """
+    hourly = hourly.dropna(subset=["temperature"])
+    days = pd.DatetimeIndex(pd.to_datetime(hourly["time"])).normalize()
+    grouped = hourly["temperature"].groupby(days)
+    table = pd.DataFrame({
+        "hours": grouped.count(),
+        "temp_sum": grouped.sum(),
+        "temp_min": grouped.min(),
+        "temp_max": grouped.max(),
+    })
+    table["days"] = 1
+    table["dmax_sum"] = table["temp_max"]
+    table["dmin_sum"] = table["temp_min"]
+    table["davg_sum"] = table["temp_sum"] / table["hours"]
+    table.index.name = "bucket"
+    return table.reset_index()[COLUMNS]
+
+
+def aggregate_buckets(child, level):
+    """
+    Merge the buckets of a lower level into `level` buckets.
+    """
+    grouped = child.groupby(bucket_start(child["bucket"], level).to_numpy())
+    table = grouped[SUM_COLUMNS].sum()
+    table["temp_min"] = grouped["temp_min"].min()
+    table["temp_max"] = grouped["temp_max"].max()
+    table.index.name = "bucket"
+    return table.reset_index()[COLUMNS]
+
+
+def partition_keys(buckets, level):
+    """
+    Partition (file) of each bucket: the year of its start, or "all" for the small year and decade levels.
+    """
+    if PARTITIONED[level]:
+        return pd.DatetimeIndex(buckets).year.astype(str)
+    return pd.Index(["all"] * len(buckets))
+
+
+def level_dir(rollup_dir, level):
+    return os.path.join(rollup_dir, level)
+
+
+def partition_file(rollup_dir, level, key):
+    return os.path.join(level_dir(rollup_dir, level), f"{key}.csv")
+
+
+def read_level(rollup_dir, level, keys=None):
+    """
+    Read the raw aggregates of the `keys` partitions of one level (all of them when None).
+    Missing partitions are skipped, so a level not built yet gives an empty table.
+    """
+    if keys is None:
+        paths = sorted(glob.glob(os.path.join(level_dir(rollup_dir, level), "*.csv")))
+    else:
+        paths = [partition_file(rollup_dir, level, key) for key in sorted(set(keys))]
+    frames = [pd.read_csv(path, parse_dates=["bucket"]) for path in paths if os.path.exists(path)]
+    if not frames:
+        return pd.DataFrame({column: pd.Series(dtype="datetime64[ns]" if column == "bucket" else float)
+                             for column in COLUMNS})
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_level(rollup_dir, level, table, keys):
+    """
+    Write the `keys` partitions of one level, each replaced atomically so readers never see a partial table.
+    """
+    os.makedirs(level_dir(rollup_dir, level), exist_ok=True)
+    table = table.sort_values("bucket")
+    partitions = partition_keys(table["bucket"], level)
+    for key in sorted(set(keys)):
+        rows = table[partitions == key]
+        csv_export.write_csv(partition_file(rollup_dir, level, key),
+                             {column: rows[column].to_numpy() for column in COLUMNS})
+
+
+def merge_buckets(table, updated):
+    """
+    Replace the rows of `table` whose bucket is in `updated` (and add new buckets).
+    """
+    if table.empty:
+        return updated
+    kept = table[~table["bucket"].isin(updated["bucket"])]
+    return pd.concat([kept, updated], ignore_index=True)
+
+
+def update_rollups(hourly, rollup_dir=ROLLUP_DIR):
+    """
+    Update the pyramid with new hourly data.
+    `hourly` must contain all hours of every day it touches (e.g. a fresh API response);
+    those days are replaced and only the week/month/season/year/decade buckets
+    containing them are recomputed. Only the partitions (years) holding these buckets
+    are read and written, so adding a day costs the same whatever the length of the history.
+    """
+    if not isinstance(hourly, pd.DataFrame):
+        hourly = pd.DataFrame(hourly, columns=["time", "temperature"])
+    if hourly.empty:
+        return
+
+    new_days = aggregate_hours(hourly)
+    # Partitions changed by the update (written at the end) and partitions read, per level
+    keys = {"day": set(partition_keys(new_days["bucket"], "day"))}
+    loaded = {"day": set(keys["day"])}
+    tables = {"day": merge_buckets(read_level(rollup_dir, "day", keys["day"]), new_days)}
+    changed = {"day": pd.DatetimeIndex(new_days["bucket"])}
+    for level in LEVELS[1:]:
+        parent = PARENT[level]
+        affected = bucket_start(changed[parent], level).unique()
+        # Parent partitions spanned by the affected buckets (a week or a winter crosses the new year),
+        # read for the aggregation only: they did not change
+        last_days = affected + BUCKET_LENGTH[level] - pd.Timedelta(days=1)
+        spanned = set(partition_keys(affected, parent)) | set(partition_keys(last_days, parent))
+        missing = spanned - loaded[parent]
+        context = read_level(rollup_dir, parent, missing) if missing else None
+        if context is not None and not context.empty:
+            tables[parent] = pd.concat([tables[parent], context], ignore_index=True)
+        loaded[parent] |= missing
+        # Only the parent rows that fall in the affected buckets are aggregated again
+        parent_rows = tables[parent][bucket_start(tables[parent]["bucket"], level).isin(affected)]
+        updated = aggregate_buckets(parent_rows, level)
+        keys[level] = set(partition_keys(updated["bucket"], level))
+        loaded[level] = set(keys[level])
+        tables[level] = merge_buckets(read_level(rollup_dir, level, keys[level]), updated)
+        changed[level] = pd.DatetimeIndex(affected)
+
+    for level, table in tables.items():
+        write_level(rollup_dir, level, table, keys[level])
+    print(f"Rollups updated for {len(changed['day'])} days in {rollup_dir}")
+
+
+def build_rollups(hourly_files, rollup_dir=ROLLUP_DIR, rebuild=False):
+    """
+    Add hourly cache files (`time`, `temperature` columns) to the pyramid.
+    Overlapping files are de-duplicated by time, the most recent file wins. Days of other date ranges
+    already in the pyramid are kept, unless `rebuild` removes the whole pyramid first.
+    """
+    frames = [quality.load_hourly(file) for file in sorted(hourly_files, key=os.path.getmtime)]
+    hourly = pd.concat(frames, ignore_index=True).drop_duplicates(subset="time", keep="last")
+    if rebuild:
+        for level in LEVELS:
+            for path in glob.glob(os.path.join(level_dir(rollup_dir, level), "*.csv")):
+                os.remove(path)
+    update_rollups(hourly, rollup_dir)
+
+
+def query(level, start=None, end=None, rollup_dir=ROLLUP_DIR):
+    """
+    Return the `level` table for buckets starting between `start` and `end` (inclusive, 'YYYY-MM-DD').
+    Only the pre-aggregated partitions of that level covering the range are read. Columns:
+    `mean` (of hourly values), `avg_max`/`avg_min`/`avg` (averages of daily max/min/avg),
+    `min`/`max` (extremes), `hours` and `days` (number of observations) and `complete`
+    (every day of the bucket has data).
+    """
+    keys = None
+    if PARTITIONED[level] and (start is not None or end is not None):
+        stored = [os.path.basename(path)[:-len(".csv")]
+                  for path in glob.glob(os.path.join(level_dir(rollup_dir, level), "*.csv"))]
+        first = pd.Timestamp(start).year if start is not None else 0
+        last = pd.Timestamp(end).year if end is not None else 9999
+        keys = [key for key in stored if first <= int(key) <= last]
+    table = read_level(rollup_dir, level, keys)
+    if start is not None:
+        table = table[table["bucket"] >= pd.Timestamp(start)]
+    if end is not None:
+        table = table[table["bucket"] <= pd.Timestamp(end)]
+    return pd.DataFrame({
+        "bucket": table["bucket"].dt.strftime("%Y-%m-%d"),
+        "mean": (table["temp_sum"] / table["hours"]).round(2),
+        "avg_max": (table["dmax_sum"] / table["days"]).round(2),
+        "avg_min": (table["dmin_sum"] / table["days"]).round(2),
+        "avg": (table["davg_sum"] / table["days"]).round(2),
+        "min": table["temp_min"],
+        "max": table["temp_max"],
+        "hours": table["hours"],
+        "days": table["days"],
+        "complete": table["days"] >= bucket_days(table["bucket"], level),
+    }).reset_index(drop=True)
+
+
+def anomalies(level, column="avg", start=None, end=None, rollup_dir=ROLLUP_DIR):
+    """
+    Monthly or seasonal anomalies: difference of each bucket with the mean of the same
+    month (or season) over all years available. Buckets with missing days (e.g. a winter
+    with only Jan-Feb) have no anomaly and are left out of the means.
+    """
+    if level not in ("month", "season"):
+        raise ValueError("Anomalies are calculated for 'month' or 'season' levels")
+    table = query(level, rollup_dir=rollup_dir)
+    period = pd.to_datetime(table["bucket"]).dt.month
+    valid = table[column].where(table["complete"])
+    table["anomaly"] = (valid - valid.groupby(period).transform("mean")).round(2)
+    if start is not None:
+        table = table[table["bucket"] >= start]
+    if end is not None:
+        table = table[table["bucket"] <= end]
+    return table[["bucket", column, "anomaly"]].reset_index(drop=True)
+
+
+def yearly_change(column="avg", start=None, end=None, rollup_dir=ROLLUP_DIR):
+    """
+    Year-over-year change of the yearly values (difference with the previous year).
+    NaN when either year is incomplete, so a partial year is never compared with a full one.
+    """
+    table = query("year", start, end, rollup_dir)
+    years = pd.to_datetime(table["bucket"]).dt.year
+    valid = table[column].where(table["complete"])
+    previous = valid.shift(1).where(years.diff() == 1)
+    table["change"] = (valid - previous).round(2)
+    return table[["bucket", column, "change"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query pre-aggregated temperature tables.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Build all levels from the hourly cache files.")
+    build_parser.add_argument("--files", nargs="*", default=glob.glob("data/*/openmeteo-*.csv"),
+                              help="Hourly CSV files (default: all openmeteo caches in data/).")
+    build_parser.add_argument("--rebuild", action="store_true",
+                              help="Remove the pyramid first instead of adding the files to it.")
+    query_parser = subparsers.add_parser("query", help="Print one level for a date range.")
+    query_parser.add_argument("level", choices=LEVELS)
+    query_parser.add_argument("--start", type=str, default=None, help="First bucket (YYYY-MM-DD).")
+    query_parser.add_argument("--end", type=str, default=None, help="Last bucket (YYYY-MM-DD).")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_rollups(args.files, rebuild=args.rebuild)
+    else:
+        print(query(args.level, args.start, args.end).to_string(index=False))
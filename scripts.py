@@ -0,0 +1,19 @@
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_script(file_name, module_name):
+    """
+    Import a script whose file name is not a valid module name (e.g. `forecast-sarima.py`).
+    Modules are loaded once per process and registered in `sys.modules`.
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, file_name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module  # Lets Flask find the templates next to the script
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,135 @@
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from flask import Flask
+
+import config
+import instrumentation
+from scripts import ROOT, load_script
+
+try:
+    import fcntl  # Not available on Windows
+except ImportError:
+    fcntl = None
+
+# Only the worker holding this lock runs the background refresh
+REFRESH_LOCK_FILE = "data/.refresh.lock"
+
+
+class RefreshScheduler:
+    """
+    Background refresh of the data, forecast and plots.
+    Every `interval` seconds the pipeline is run in a separate process (see config.REFRESH_PIPELINES),
+    so the heavy work never competes with requests for the worker's CPU or GIL; requests only
+    read the files it produces. With several workers, only the one holding REFRESH_LOCK_FILE refreshes;
+    the others keep trying to take the lock, so refreshes go on if that worker exits.
+    """
+
+    def __init__(self, pipelines, interval):
+        self.pipelines = pipelines
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.lock_file = None
+        self.thread = None
+        self.last_status = {}
+
+    def acquire_lock(self):
+        if fcntl is None or self.lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(REFRESH_LOCK_FILE), exist_ok=True)
+        self.lock_file = open(REFRESH_LOCK_FILE, "w")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self.lock_file.close()
+            self.lock_file = None
+            return False
+
+    def refresh(self):
+        for arguments in self.pipelines:
+            with instrumentation.stage("background_refresh") as stage:
+                result = subprocess.run([sys.executable, os.path.join(ROOT, "pipeline.py"), *arguments], cwd=os.getcwd())
+                stage.extra["arguments"] = arguments
+                stage.extra["returncode"] = result.returncode
+            self.last_status[" ".join(arguments)] = {"returncode": result.returncode, "finished": time.time()}
+
+    @property
+    def active(self):
+        return self.lock_file is not None or (fcntl is None and self.thread is not None)
+
+    def loop(self):
+        while not self.stop_event.is_set():
+            if self.acquire_lock():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Background refresh failed: {e}")
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.loop, name="refresh-scheduler", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def create_app(refresh=True, interval=None):
+    """
+    Application factory of the production server, e.g. `gunicorn -w 4 -b 0.0.0.0:8080 'server:create_app()'`.
+    Mounts the forecast page at `/` and the plots page at `/plots/`; both only read precomputed
+    files, which a background scheduler keeps up to date.
+    """
+    app = Flask(__name__)
+    app.config["PRECOMPUTED_ONLY"] = True
+    app.register_blueprint(load_script("app.py", "forecast_app").bp)
+    app.register_blueprint(load_script("flask-webserver.py", "plot_webserver").bp, url_prefix="/plots")
+    instrumentation.instrument_app(app)
+
+    scheduler = RefreshScheduler(config.REFRESH_PIPELINES, interval or config.REFRESH_INTERVAL_SEC)
+    if refresh:
+        scheduler.start()
+    app.extensions["refresh_scheduler"] = scheduler
+
+    @app.route("/healthz")
+    def healthz():
+        return {"status": "ok", "refresh_worker": scheduler.active, "refresh": scheduler.last_status}
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Combined forecast and plots server with background refresh.")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes (gunicorn).")
+    parser.add_argument("--threads", type=int, default=4, help="Threads per worker (gunicorn).")
+    parser.add_argument("--no-refresh", action="store_true", help="Do not run the background refresh.")
+    args = parser.parse_args()
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        BaseApplication = None
+
+    if BaseApplication is None:
+        # Single process fallback (e.g. on Windows where gunicorn is not available)
+        from werkzeug.serving import run_simple
+        run_simple(args.host, args.port, create_app(refresh=not args.no_refresh), threaded=True)
+    else:
+        class Server(BaseApplication):
+            def load_config(self):
+                self.cfg.set("bind", f"{args.host}:{args.port}")
+                self.cfg.set("workers", args.workers)
+                self.cfg.set("threads", args.threads)
+
+            def load(self):
+                return create_app(refresh=not args.no_refresh)
+
+        Server().run()
@@ -3,6 +3,7 @@ import requests
 import csv
 import datetime
 import config  # Importing configurations for API URLs, keys, etc.
+import http_cache  # Cache of raw API responses
 
 # Function to fetch historical weather data from VisualCrossing API
 def fetch_visualcrossing_weather_data(location, start_date, end_date):
@@ -12,13 +13,9 @@ def fetch_visualcrossing_weather_data(location, start_date, end_date):
         # Base URL for the VisualCrossing API from config file
         base_url = config.VISUALCROSSING_API_TMPL.format(zip=location, start_dt=start_date, end_dt=end_date, type="metric", API_key=api_key)
         
-        # Make a GET request to the API
-        response = requests.get(base_url)
-        # Raise an error if the response indicates a failure
-        response.raise_for_status()
-
-        # Parse the response JSON
-        data = response.json()
+        # Make a GET request to the API (served from the response cache when possible)
+        # Raises an error if the response indicates a failure
+        data = http_cache.get_json(base_url)
         return data
     except requests.exceptions.RequestException as e:
         # Print error message if there was an issue with the request
@@ -64,15 +61,11 @@ def test_visualcrossing_api():
 def fetch_openmeteo_weather_data(latitude, longitude, start_date, end_date):
     try:
         # Base URL for the Open-Meteo API from config file
-        base_url = config.OPEN_METEO_API_TMPL.format(lat=latitude, long=longitude, start_dt=start_date, end_date=end_date)
+        base_url = config.OPEN_METEO_API_TMPL.format(lat=latitude, long=longitude, start_dt=start_date, end_dt=end_date)
         
-        # Make a GET request to the API
-        response = requests.get(base_url)
-        # Raise an error if the response indicates a failure
-        response.raise_for_status()
-
-        # Parse the response JSON
-        data = response.json()
+        # Make a GET request to the API (served from the response cache when possible)
+        # Raises an error if the response indicates a failure
+        data = http_cache.get_json(base_url)
         return data
     except requests.exceptions.RequestException as e:
         # Print error message if there was an issue with the request
@@ -125,10 +118,7 @@ def fetch_openmeteo_weather_data(latitude, longitude, start_date, end_date):
             "timezone": "America/New_York"
         }
 
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-
-        data = response.json()
+        data = http_cache.get_json(base_url, params=params)
         return data
     except requests.exceptions.RequestException as e:
         print(f"Error fetching data from Open-Meteo API: {e}")
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+# Default reference period of the climatology (WMO climate normal)
+BASELINE = (1991, 2020)
+# Share of the days of a year that must have data for the year to count as complete
+MIN_COVERAGE = 0.95
+
+
+def yearly_table(daily):
+    """
+    Aggregate daily values to years for all stations at once.
+    `daily` is a DataFrame indexed by date with one column per station (NaN = no data).
+    Returns a dict of DataFrames indexed by year, one column per station:
+    `mean`, `days` (days with data), `coverage` (share of the calendar year) and `complete`.
+    Years are contiguous (missing years are rows of NaN), so differences are always with the previous calendar year.
+    """
+    daily = daily.apply(pd.to_numeric, errors="coerce")
+    years = pd.DatetimeIndex(daily.index).year
+    grouped = daily.groupby(years)
+    all_years = pd.RangeIndex(years.min(), years.max() + 1, name="year")
+
+    mean = grouped.mean().reindex(all_years)
+    days = grouped.count().reindex(all_years, fill_value=0)
+    leap = (all_years % 4 == 0) & ((all_years % 100 != 0) | (all_years % 400 == 0))
+    days_in_year = np.where(leap, 366, 365)
+    coverage = days.div(days_in_year, axis=0)
+    return {"mean": mean, "days": days, "coverage": coverage, "complete": coverage >= MIN_COVERAGE}
+
+
+def yoy_delta(mean, complete):
+    """
+    Year-over-year change in degrees (current year minus previous year).
+    NaN when either year is incomplete, so a partial year is never compared with a full one.
+    """
+    valid = mean.where(complete)
+    return valid - valid.shift(1)
+
+
+def climatology(mean, complete, baseline=BASELINE):
+    """
+    Mean of the complete years of the baseline period for every station.
+    Stations without any complete baseline year fall back to all their complete years.
+    """
+    valid = mean.where(complete)
+    in_baseline = (valid.index >= baseline[0]) & (valid.index <= baseline[1])
+    reference = valid[in_baseline].mean()
+    return reference.fillna(valid.mean())
+
+
+def anomalies(mean, complete, baseline=BASELINE):
+    """
+    Difference of every year with the station climatology over `baseline`.
+    NaN for incomplete years, like `yoy_delta`: a partial year is biased by the season it misses.
+    """
+    return mean.where(complete) - climatology(mean, complete, baseline)
+
+
+def linear_trend(mean, complete, confidence=0.95):
+    """
+    Least-squares linear trend of the complete years for every station, as array operations.
+    Returns a DataFrame indexed by station with `slope` (°C/year), `slope_per_decade`,
+    `intercept`, `stderr`, `ci_low`/`ci_high` (confidence interval of the slope per decade)
+    and `n` (years used).
+    """
+    from scipy import stats  # Imported on use, it is slow to load
+
+    y = mean.where(complete).to_numpy(dtype=float)
+    mask = ~np.isnan(y)
+    x = np.broadcast_to(mean.index.to_numpy(dtype=float)[:, None], y.shape)
+
+    n = mask.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = np.where(mask, x, 0).sum(axis=0) / n
+        y_mean = np.where(mask, y, 0).sum(axis=0) / n
+        dx = np.where(mask, x - x_mean, 0)
+        dy = np.where(mask, y - y_mean, 0)
+        sxx = (dx * dx).sum(axis=0)
+        slope = (dx * dy).sum(axis=0) / sxx
+        intercept = y_mean - slope * x_mean
+        residuals = np.where(mask, y - (intercept + slope * x), 0)
+        stderr = np.sqrt((residuals * residuals).sum(axis=0) / (n - 2) / sxx)
+        margin = stats.t.ppf((1 + confidence) / 2, n - 2) * stderr
+
+    slope = np.where(n >= 2, slope, np.nan)
+    return pd.DataFrame({
+        "slope": slope,
+        "slope_per_decade": slope * 10,
+        "intercept": intercept,
+        "stderr": stderr,
+        "ci_low": (slope - margin) * 10,
+        "ci_high": (slope + margin) * 10,
+        "n": n,
+    }, index=mean.columns)
+
+
+def analyze(daily, baseline=BASELINE, confidence=0.95):
+    """
+    Yearly means, year-over-year deltas, anomalies, completeness and trends for all stations.
+    Returns (yearly, trend): `yearly` is a long DataFrame with one row per station and year,
+    `trend` is the output of `linear_trend`.
+    """
+    table = yearly_table(daily)
+    mean, complete = table["mean"], table["complete"]
+    columns = {
+        "TEMPERATURE": mean.round(2),
+        "CHANGE": yoy_delta(mean, complete).round(2),
+        "ANOMALY": anomalies(mean, complete, baseline).round(2),
+        "DAYS": table["days"],
+        "COMPLETE": complete,
+    }
+    index = pd.MultiIndex.from_product([mean.index, mean.columns], names=["Year", "Station"])
+    yearly = pd.DataFrame({name: frame.to_numpy().ravel() for name, frame in columns.items()}, index=index)
+    return yearly, linear_trend(mean, complete, confidence)